@@ -1,8 +1,123 @@
 import os
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+# Already loaded by the runtime that imports this module, so this costs nothing at cold start.
+# google.cloud.storage and smtplib are imported on first use instead (see GCSStore / Mailer).
 import functions_framework
-from google.cloud import storage
-from src.emailer import send_chunk_email
-from src.state_manager import update_state, get_last_chunk_id
+from src.emailer import Mailer, send_chunk_email, send_chunk_mime
+from src.chunk_template import render_stored_chunk
+from src.object_store import open_store, ObjectNotFound
+from src.state_manager import open_state_session
+
+# Books dispatched in parallel; override with the DISPATCH_CONCURRENCY env var (1 = sequential)
+DEFAULT_DISPATCH_CONCURRENCY = 8
+
+# Created on first use and kept for the life of the instance, so warm
+# invocations reuse the same credentials and HTTP session
+_stores = {}
+
+def get_store(location):
+    """
+    The object store for location (see object_store.open_store): normally
+    the GCS_BUCKET_NAME bucket, or OBJECT_STORE when set, e.g. a local
+    directory for offline runs.
+    """
+    if location not in _stores:
+        _stores[location] = open_store(location)
+    return _stores[location]
+
+def dispatch_concurrency():
+    """DISPATCH_CONCURRENCY as a positive int; an unparseable value falls back to the default."""
+    value = os.environ.get("DISPATCH_CONCURRENCY")
+    if not value:
+        return DEFAULT_DISPATCH_CONCURRENCY
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"Warning: DISPATCH_CONCURRENCY={value!r} is not an integer; using {DEFAULT_DISPATCH_CONCURRENCY}")
+        return DEFAULT_DISPATCH_CONCURRENCY
+
+def dispatch_book(book_id, book_data, store, target_email, mailer=None):
+    """
+    Sends the next chunk (or the completion email) for one book. Errors are
+    caught and reported in the result, so one bad book never stops the rest.
+    Returns {'message', 'sent': chunk id or None, 'finished': bool}; the
+    caller applies the state change.
+    """
+    try:
+        # Determine Next Chunk
+        last_id = book_data.get("last_chunk_id", 0)
+        next_id = last_id + 1
+        
+        # New Path: books/<book_id>/chunks/chunk_XXX.html, or chunk_XXX.eml for books
+        # uploaded with pre-built MIME bodies (chunk_format recorded by upload_to_gcs.py)
+        chunk_format = book_data.get("chunk_format", "html")
+        chunk_filename = f"books/{book_id}/chunks/chunk_{next_id:03d}.{chunk_format}"
+        
+        book_title = book_id.replace("_", " ").title()
+
+        # Read Chunk from the store: one request (chunks are stored gzip-compressed and
+        # inflated by the store). total_chunks (written by upload_to_gcs.py) lets a
+        # finished book skip storage entirely; older state falls back to ObjectNotFound
+        stored = None
+        total_chunks = book_data.get("total_chunks")
+        # Books uploaded with a pack: chunk N is bytes chunk_offsets[N-1]..chunk_offsets[N] of
+        # books/<book_id>/<chunk_pack>, a gzip member, fetched with one ranged read. The pack is
+        # named after its content, so these offsets always belong to the object they name
+        chunk_offsets = book_data.get("chunk_offsets")
+        if chunk_offsets:
+            if next_id < len(chunk_offsets):
+                start, end = chunk_offsets[next_id - 1], chunk_offsets[next_id]
+                chunk_pack = book_data.get("chunk_pack", "chunks.pack")
+                stored = gzip.decompress(store.get_range(f"books/{book_id}/{chunk_pack}", start, end - 1))
+                if chunk_format != "eml":
+                    stored = stored.decode("utf-8")
+        elif total_chunks is None or next_id <= total_chunks:
+            try:
+                stored, _ = store.get(chunk_filename)
+                if chunk_format != "eml":
+                    stored = stored.decode("utf-8")
+            except ObjectNotFound:
+                pass
+
+        if stored is None:
+            # --- BOOK FINISHED LOGIC ---
+            msg = f"[{book_id}] Book completed! No chunk {next_id} found."
+            print(msg)
+            
+            # 1. Send Completion Email
+            completion_subject = f"{book_title} - Completed"
+            completion_body = f"""
+            <html>
+            <body>
+                <h2>Congratulations!</h2>
+                <p>You have finished reading <strong>{book_title}</strong>.</p>
+                <p>This book has now been pushed to the archives.</p>
+                <p>Reply to this email if you'd like to start a new one!</p>
+            </body>
+            </html>
+            """
+            send_chunk_email(target_email, completion_subject, completion_body, mailer=mailer)
+            
+            # 2. Mark as Inactive
+            return {"message": f"[{book_id}] Finished & Deactivated.", "sent": None, "finished": True}
+        
+        # Send Email
+        subject = f"{book_title} - Part {next_id}"
+        if chunk_format == "eml":
+            # Already encoded with its text/plain alternative; only the headers are added
+            send_chunk_mime(target_email, subject, stored, mailer=mailer)
+        else:
+            # Body-only chunks get the page shell applied here
+            content = render_stored_chunk(stored)
+            send_chunk_email(target_email, subject, content, mailer=mailer)
+        
+        return {"message": f"[{book_id}] Sent chunk {next_id}", "sent": next_id, "finished": False}
+        
+    except Exception as e:
+        err_msg = f"[{book_id}] Error: {str(e)}"
+        print(err_msg)
+        return {"message": err_msg, "sent": None, "finished": False}
 
 @functions_framework.http
 def daily_emailer(request):
@@ -11,80 +126,57 @@ def daily_emailer(request):
     """
     # 1. Load Config
     bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    store_location = os.environ.get('OBJECT_STORE') or (bucket_name and f"gs://{bucket_name}")
     target_email = os.environ.get('TARGET_EMAIL')
     
-    if not bucket_name or not target_email:
+    if not store_location or not target_email:
         return "Missing env vars: GCS_BUCKET_NAME or TARGET_EMAIL", 500
 
     # 2. Load State to find active books
-    from src.state_manager import load_state, update_state, set_book_active
-    
-    state = load_state(bucket_name)
+    # All per-book updates go into one session, written back once at the end
+    store = get_store(store_location)
+    session = open_state_session(store, active_only=True)
+    state = dict(session.state)
     if not state:
-        return "No books found in sending_state.json", 200
+        return "No books found in state", 200
         
-    results = []
-    
-    # 3. Process Each Active Book
-    for book_id, book_data in state.items():
-        # Skip inactive books
-        if not book_data.get("active", False):
-            continue
+    # 3. Process Each Active Book (DISPATCH_CONCURRENCY books at a time)
+    active_books = [(book_id, book_data) for book_id, book_data in state.items() if book_data.get("active", False)]
+    concurrency = dispatch_concurrency()
 
-        try:
-            # Determine Next Chunk
-            last_id = book_data.get("last_chunk_id", 0)
-            next_id = last_id + 1
-            
-            # New Path: books/<book_id>/chunks/chunk_XXX.html
-            chunk_filename = f"books/{book_id}/chunks/chunk_{next_id:03d}.html"
-            
-            # Read Chunk from GCS
-            storage_client = storage.Client()
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(chunk_filename)
-            
-            book_title = book_id.replace("_", " ").title()
+    # One pool of authenticated SMTP sessions for the whole run
+    try:
+        mailer = Mailer()
+    except ValueError as e:
+        return str(e), 500
 
-            if not blob.exists():
-                # --- BOOK FINISHED LOGIC ---
-                msg = f"[{book_id}] Book completed! No chunk {next_id} found."
-                print(msg)
-                
-                # 1. Send Completion Email
-                completion_subject = f"{book_title} - Completed"
-                completion_body = f"""
-                <html>
-                <body>
-                    <h2>Congratulations!</h2>
-                    <p>You have finished reading <strong>{book_title}</strong>.</p>
-                    <p>This book has now been pushed to the archives.</p>
-                    <p>Reply to this email if you'd like to start a new one!</p>
-                </body>
-                </html>
-                """
-                send_chunk_email(target_email, completion_subject, completion_body)
-                
-                # 2. Mark as Inactive
-                set_book_active(book_id, False, bucket_name=bucket_name)
-                
-                results.append(f"[{book_id}] Finished & Deactivated.")
-                continue
-            
-            content = blob.download_as_text()
-            
-            # Send Email
-            subject = f"{book_title} - Part {next_id}"
-            send_chunk_email(target_email, subject, content)
-            
-            # Update State
-            update_state(book_id, next_id, bucket_name=bucket_name)
-            
-            results.append(f"[{book_id}] Sent chunk {next_id}")
-            
-        except Exception as e:
-            err_msg = f"[{book_id}] Error: {str(e)}"
-            print(err_msg)
-            results.append(err_msg)
+    def dispatch(item):
+        book_id, book_data = item
+        return dispatch_book(book_id, book_data, store, target_email, mailer=mailer)
+
+    with mailer:
+        if concurrency > 1 and len(active_books) > 1:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(active_books))) as executor:
+                outcomes = list(executor.map(dispatch, active_books))
+        else:
+            outcomes = [dispatch(item) for item in active_books]
+
+    # Apply state changes here, in book order; the session isn't shared with the workers
+    results = []
+    for (book_id, _), outcome in zip(active_books, outcomes):
+        if outcome["finished"]:
+            session.set_active(book_id, False)
+        elif outcome["sent"]:
+            session.record_sent(book_id, outcome["sent"])
+        results.append(outcome["message"])
+
+    # 4. Save State (one write, retried and merged if set_active_book.py wrote meanwhile)
+    try:
+        session.commit()
+    except Exception as e:
+        err_msg = f"Error saving state: {str(e)}"
+        print(err_msg)
+        results.append(err_msg)
+        return "\n".join(results), 500
 
     return "\n".join(results), 200
@@ -0,0 +1,269 @@
+"""
+Offline benchmark for src/html_chunker.py.
+
+Builds synthetic EPUBs of a configurable shape (spine size, paragraph
+length, wrapper nesting, image count) and times process_epub,
+clean_title and create_html_chunk separately. Each scenario runs in a
+fresh worker process so its peak RSS is its own.
+
+    uv run scripts/bench_chunker.py                     # all scenarios
+    uv run scripts/bench_chunker.py --save-baseline     # record a baseline
+    uv run scripts/bench_chunker.py --compare           # fail on regressions
+"""
+import os
+import sys
+import json
+import time
+import random
+import struct
+import zlib
+import zipfile
+import resource
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Add src to path so we can import the chunker
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "bench_chunker_baseline.json")
+
+# Shapes the sample books in books/ don't cover
+SCENARIOS = {
+    "novel": {"docs": 60, "paragraphs": 40, "words": 60, "depth": 1, "images": 0},
+    "many_docs": {"docs": 10_000, "paragraphs": 3, "words": 40, "depth": 1, "images": 0},
+    "deep_nesting": {"docs": 40, "paragraphs": 40, "words": 60, "depth": 40, "images": 0},
+    "many_images": {"docs": 200, "paragraphs": 10, "words": 60, "depth": 1, "images": 3_000},
+}
+
+WORDS = ("whale sea ship captain harpoon deck mast sail storm wave island harbor sailor voyage "
+         "rope anchor compass tide fog night morning gull oar crew cabin lantern salt").split()
+
+def _png(seed, size=16):
+    """A tiny valid RGB PNG with a colour derived from seed, so every image hashes differently."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    pixel = bytes(((seed * 37) % 256, (seed * 101) % 256, (seed // 256) % 256))
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+def generate_epub(path, docs=60, paragraphs=40, words=60, depth=1, images=0, seed=0):
+    """
+    Writes a synthetic EPUB to path and returns the number of body words in it.
+    Each document opens with a chapter heading wrapped in `depth` nested
+    section/div elements; images are spread evenly across the documents.
+    Every other document has a bare <body>, the rest carry a class.
+    """
+    rng = random.Random(seed)
+    manifest = ['<item id="cover-img" href="images/cover.png" media-type="image/png" properties="cover-image"/>']
+    spine = []
+    total_words = 0
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        # mimetype must be the first, uncompressed member
+        z.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/container.xml",
+                   '<?xml version="1.0"?>\n'
+                   '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                   '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                   '</rootfiles></container>')
+        z.writestr("OEBPS/images/cover.png", _png(0, size=64))
+
+        image_id = 0
+        for d in range(docs):
+            # Distribute images so the first (images % docs) documents get one extra
+            doc_images = images // docs + (1 if d < images % docs else 0)
+            body = [f"<h2>CHAPTER {d + 1}. THE {rng.choice(WORDS).upper()}</h2>"]
+            for p in range(paragraphs):
+                text = " ".join(rng.choice(WORDS) for _ in range(words))
+                total_words += words
+                body.append(f"<p>{text}</p>")
+                # Interleave this document's images with its paragraphs
+                if doc_images and p % max(1, paragraphs // doc_images) == 0:
+                    image_id += 1
+                    doc_images -= 1
+                    name = f"images/img_{image_id:05d}.png"
+                    z.writestr(f"OEBPS/{name}", _png(image_id))
+                    manifest.append(f'<item id="img{image_id}" href="{name}" media-type="image/png"/>')
+                    body.append(f'<div class="figure"><img src="../{name}" alt=""/></div>')
+            for _ in range(doc_images):
+                image_id += 1
+                name = f"images/img_{image_id:05d}.png"
+                z.writestr(f"OEBPS/{name}", _png(image_id))
+                manifest.append(f'<item id="img{image_id}" href="{name}" media-type="image/png"/>')
+                body.append(f'<p><img src="../{name}" alt=""/></p>')
+
+            content = "\n".join(body)
+            for level in range(depth):
+                tag = "section" if level % 2 == 0 else "div"
+                content = f"<{tag}>{content}</{tag}>"
+
+            # Real books use both a bare <body> (which get_body_content() strips) and one with attributes
+            body_tag = "<body>" if d % 2 == 0 else '<body class="chapter">'
+            z.writestr(f"OEBPS/text/doc_{d:05d}.xhtml",
+                       '<?xml version="1.0" encoding="utf-8"?>\n'
+                       '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>doc</title></head>'
+                       f'{body_tag}{content}</body></html>')
+            manifest.append(f'<item id="doc{d}" href="text/doc_{d:05d}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="doc{d}"/>')
+
+        z.writestr("OEBPS/content.opf",
+                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+                   '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                   '<dc:identifier id="id">synthetic</dc:identifier><dc:title>Synthetic Book</dc:title>'
+                   '<dc:language>en</dc:language></metadata>'
+                   f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>')
+
+    return total_words
+
+def _peak_rss():
+    # ru_maxrss is KiB on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _bench_process_epub(name, shape, options):
+    # Runs in its own worker process, inside a scratch directory, so book_output/ stays untouched
+    from html_chunker import process_epub
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        epub_path = os.path.join(tmp, f"{name}.epub")
+        total_words = generate_epub(epub_path, **shape)
+
+        start = time.perf_counter()
+        chunks = process_epub(epub_path, name, **options)
+        seconds = time.perf_counter() - start
+
+    return {
+        "seconds": round(seconds, 4),
+        "words": total_words,
+        "chunks": chunks,
+        "words_per_s": round(total_words / seconds),
+        "chunks_per_s": round(chunks / seconds, 2),
+        "peak_rss_bytes": _peak_rss(),
+    }
+
+def _bench_clean_title(count=50_000):
+    from html_chunker import clean_title
+
+    rng = random.Random(1)
+    titles = [f"CHAPTER {rng.randint(1, 200)}. THE {rng.choice(WORDS).upper()} OF THE {rng.choice(WORDS).upper()}"
+              for _ in range(count // 2)]
+    titles += [f"Chapter {'ivxlc'[rng.randint(0, 4)] * rng.randint(1, 3)}. {rng.choice(WORDS)}"
+               for _ in range(count - len(titles))]
+
+    start = time.perf_counter()
+    for title in titles:
+        clean_title(title)
+    seconds = time.perf_counter() - start
+    return {"seconds": round(seconds, 4), "calls": count, "calls_per_s": round(count / seconds)}
+
+def _bench_create_html_chunk(count=500, words=2500):
+    from html_chunker import create_html_chunk
+
+    rng = random.Random(2)
+    paragraphs = [f"<p>{' '.join(rng.choice(WORDS) for _ in range(50))}</p>" for _ in range(words // 50)]
+    chapters = [f"Chapter {i}" for i in range(1, 4)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        written = 0
+        start = time.perf_counter()
+        for chunk_id in range(1, count + 1):
+            _, size = create_html_chunk(paragraphs, chunk_id, count, "Synthetic Book", "bench",
+                                        chapter_list=chapters, next_chunk_id=chunk_id + 1)
+            written += size
+        seconds = time.perf_counter() - start
+
+    return {"seconds": round(seconds, 4), "chunks": count, "chunks_per_s": round(count / seconds, 2),
+            "bytes_per_s": round(written / seconds), "peak_rss_bytes": _peak_rss()}
+
+def _in_fresh_process(fn, *args, repeat=1):
+    # Best of `repeat` runs, each in a new process so peak RSS isn't inherited from the previous one
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            runs.append(executor.submit(fn, *args).result())
+    return min(runs, key=lambda r: r["seconds"])
+
+def run_benchmarks(scenarios, scale=1.0, options=None, repeat=3):
+    results = {}
+    for name in scenarios:
+        shape = dict(SCENARIOS[name])
+        # Scale spine size and image count; the per-document shape stays the same
+        shape["docs"] = max(1, int(shape["docs"] * scale))
+        shape["images"] = int(shape["images"] * scale)
+        print(f"--- process_epub: {name} {shape} ---")
+        results[f"process_epub/{name}"] = _in_fresh_process(_bench_process_epub, name, shape, options or {},
+                                                             repeat=repeat)
+        print(json.dumps(results[f"process_epub/{name}"]))
+
+    print("--- clean_title ---")
+    results["clean_title"] = _in_fresh_process(_bench_clean_title, repeat=repeat)
+    print(json.dumps(results["clean_title"]))
+
+    print("--- create_html_chunk ---")
+    results["create_html_chunk"] = _in_fresh_process(_bench_create_html_chunk, repeat=repeat)
+    print(json.dumps(results["create_html_chunk"]))
+    return results
+
+def compare(results, baseline, tolerance):
+    """Prints the change against baseline per benchmark; returns the names slower than tolerance allows."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name}: no baseline")
+            continue
+        change = result["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        rss = ""
+        if "peak_rss_bytes" in result and base.get("peak_rss_bytes"):
+            rss = f", peak RSS {result['peak_rss_bytes'] / base['peak_rss_bytes'] - 1:+.1%}"
+        flag = ""
+        if change > tolerance:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"{name}: {base['seconds']:.3f}s -> {result['seconds']:.3f}s ({change:+.1%}{rss}){flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark html_chunker on synthetic EPUBs (runs offline).")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply each scenario's spine size and image count (e.g. 0.1 for a quick run)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest one is reported")
+    parser.add_argument("--engine", choices=["soup", "lxml"], default="soup")
+    parser.add_argument("--doc-jobs", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare against the baseline and exit non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed slowdown before a benchmark counts as a regression (default 0.15 = 15%%)")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    results = run_benchmarks(scenarios, scale=args.scale,
+                             options={"engine": args.engine, "doc_jobs": args.doc_jobs}, repeat=args.repeat)
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"No baseline at {args.baseline}; run with --save-baseline first")
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline.get("scale"), baseline.get("engine")) != (args.scale, args.engine):
+            print(f"Warning: baseline was recorded with scale={baseline.get('scale')} "
+                  f"engine={baseline.get('engine')}; timings are not comparable")
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"scale": args.scale, "engine": args.engine, "python": sys.version.split()[0],
+                       "results": results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
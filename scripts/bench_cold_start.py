@@ -0,0 +1,99 @@
+"""
+Cold-start benchmark for the Cloud Function in main.py.
+
+Each run starts a fresh interpreter (as a new instance would), times
+`import main` and then the first daily_emailer request against local
+stand-ins for GCS and SMTP (scripts/local_services.py), so it runs fully
+offline. Exits non-zero when the median of either exceeds its budget.
+
+    uv run scripts/bench_cold_start.py
+    uv run scripts/bench_cold_start.py --books 20 --runs 10 --import-budget-ms 40
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from local_services import FakeGCS, SMTPSink
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BUCKET = "bench-bucket"
+
+# Runs inside the fresh interpreter. functions_framework is imported first because in the
+# deployed runtime it is the process that loads main, so it is never part of main's cost.
+CHILD = """
+import json, time
+import functions_framework
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+body, status = main.daily_emailer(None)
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_request_ms": (done - imported) * 1000,
+                  "status": status, "body": body}))
+"""
+
+def seed(gcs, books):
+    """Fresh state with every book about to send chunk 1."""
+    state = {}
+    for i in range(books):
+        book_id = f"book_{i:03d}"
+        state[book_id] = {"active": True, "last_chunk_id": 0, "total_chunks": 1}
+        gcs.put(BUCKET, f"books/{book_id}/chunks/chunk_001.html",
+                "<html><body>" + "<p>Call me Ishmael.</p>" * 2000 + "</body></html>", "text/html")
+    gcs.put(BUCKET, "sending_state.json", json.dumps(state, indent=4), "application/json")
+
+def run_once(gcs, smtp, books):
+    seed(gcs, books)
+    env = dict(os.environ,
+               # Mirror the deployed runtime (no .env lookup) and point it at the stand-ins
+               K_SERVICE="bench-cold-start",
+               STORAGE_EMULATOR_HOST=gcs.url,
+               GCS_BUCKET_NAME=BUCKET,
+               TARGET_EMAIL="reader@example.com",
+               GMAIL_USER="sender@example.com",
+               GMAIL_APP_PASSWORD="bench",
+               SMTP_HOST="127.0.0.1",
+               SMTP_PORT=str(smtp.port),
+               SMTP_STARTTLS="0")
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=REPO_ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    if result["status"] != 200 or result["body"].count("Sent chunk") != books:
+        raise RuntimeError(f"Unexpected response ({result['status']}): {result['body']}")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and first-request latency of main.py.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh-interpreter runs; medians are reported")
+    parser.add_argument("--books", type=int, default=5, help="Active books in the seeded state")
+    parser.add_argument("--import-budget-ms", type=float, default=50.0)
+    parser.add_argument("--first-request-budget-ms", type=float, default=1500.0)
+    args = parser.parse_args()
+
+    gcs = FakeGCS().start()
+    smtp = SMTPSink().start()
+    try:
+        runs = []
+        for i in range(args.runs):
+            result = run_once(gcs, smtp, args.books)
+            print(f"run {i + 1}: import {result['import_ms']:.1f} ms, first request {result['first_request_ms']:.1f} ms")
+            runs.append(result)
+    finally:
+        gcs.stop()
+        smtp.stop()
+
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    request_ms = statistics.median(r["first_request_ms"] for r in runs)
+    print(f"\nmedian import main:    {import_ms:.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"median first request:  {request_ms:.1f} ms (budget {args.first_request_budget_ms:.0f} ms, {args.books} books)")
+
+    over = []
+    if import_ms > args.import_budget_ms:
+        over.append("import")
+    if request_ms > args.first_request_budget_ms:
+        over.append("first request")
+    if over:
+        sys.exit(f"Over budget: {', '.join(over)}")
@@ -0,0 +1,91 @@
+"""
+Reports how well the chunks in book_output/ compress, per book and in
+total: stored size with gzip (what upload_to_gcs.py uses) and, when a
+zstd module is available, zstd, plus compress/decompress time per chunk.
+
+    uv run scripts/bench_compression.py
+    uv run scripts/bench_compression.py --level 6
+"""
+import os
+import glob
+import gzip
+import time
+import argparse
+
+def _zstd():
+    """(compress, decompress) from the stdlib zstd module (3.14+) or zstandard, else None."""
+    try:
+        from compression import zstd
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdCompressor(level=19).compress, zstandard.ZstdDecompressor().decompress
+    except ImportError:
+        return None
+
+def _measure(files, compress, decompress):
+    raw = packed = 0
+    compress_s = decompress_s = 0.0
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        start = time.perf_counter()
+        blob = compress(data)
+        compress_s += time.perf_counter() - start
+        start = time.perf_counter()
+        decompress(blob)
+        decompress_s += time.perf_counter() - start
+        raw += len(data)
+        packed += len(blob)
+    return {"raw": raw, "packed": packed, "compress_s": compress_s, "decompress_s": decompress_s}
+
+def chunk_files(book_dir):
+    # Whatever upload_to_gcs.py would upload as chunks: .eml, body-only or full pages
+    files = glob.glob(os.path.join(book_dir, "chunk_*.eml"))
+    files += glob.glob(os.path.join(book_dir, "chunk_*.body.html"))
+    pages = glob.glob(os.path.join(book_dir, "chunk_*.html"))
+    files += [f for f in pages if not f.endswith(".body.html")
+              and not os.path.exists(f.replace(".html", ".body.html"))]
+    return sorted(files)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compression ratio of the current chunks in book_output/.")
+    parser.add_argument("--source-dir", default="book_output")
+    parser.add_argument("--level", type=int, default=9, help="gzip compression level (upload_to_gcs.py uses 9)")
+    args = parser.parse_args()
+
+    codecs = {"gzip": (lambda d: gzip.compress(d, compresslevel=args.level, mtime=0), gzip.decompress)}
+    zstd = _zstd()
+    if zstd:
+        codecs["zstd"] = zstd
+    else:
+        print("zstd: not available (Python 3.14+ or `pip install zstandard`), reporting gzip only\n")
+
+    books = sorted(d for d in os.listdir(args.source_dir) if os.path.isdir(os.path.join(args.source_dir, d)))
+    totals = {name: {"raw": 0, "packed": 0, "compress_s": 0.0, "decompress_s": 0.0} for name in codecs}
+    chunk_count = 0
+
+    print(f"{'book':<28}{'codec':<7}{'chunks':>7}{'raw KB':>10}{'stored KB':>11}{'ratio':>8}")
+    for book_id in books:
+        files = chunk_files(os.path.join(args.source_dir, book_id))
+        if not files:
+            continue
+        chunk_count += len(files)
+        for name, (compress, decompress) in codecs.items():
+            result = _measure(files, compress, decompress)
+            for key in totals[name]:
+                totals[name][key] += result[key]
+            print(f"{book_id:<28}{name:<7}{len(files):>7}{result['raw'] / 1024:>10.1f}"
+                  f"{result['packed'] / 1024:>11.1f}{result['raw'] / result['packed']:>7.1f}x")
+
+    if not chunk_count:
+        print(f"No chunks found in {args.source_dir}/; run html_chunker.py first")
+    else:
+        print()
+        for name, t in totals.items():
+            print(f"{name}: {t['raw'] / 1024:.0f} KB -> {t['packed'] / 1024:.0f} KB "
+                  f"({t['raw'] / t['packed']:.1f}x, {1 - t['packed'] / t['raw']:.0%} smaller); "
+                  f"per chunk {t['compress_s'] / chunk_count * 1000:.2f} ms to compress, "
+                  f"{t['decompress_s'] / chunk_count * 1000:.2f} ms to decompress")
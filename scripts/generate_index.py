@@ -1,7 +1,25 @@
 
 import os
+import sys
 import glob
 
+# Add src to path so we can import chunk_template
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from chunk_template import render_stored_chunk
+
+def render_body_chunks(book_path):
+    """Applies the page shell to body-only chunks so Firebase Hosting serves full pages."""
+    for body_path in glob.glob(os.path.join(book_path, "chunk_*.body.html")):
+        with open(body_path, "r", encoding="utf-8") as f:
+            page = render_stored_chunk(f.read())
+        page_path = body_path.replace(".body.html", ".html")
+        if os.path.exists(page_path):
+            with open(page_path, "r", encoding="utf-8") as f:
+                if f.read() == page:
+                    continue
+        with open(page_path, "w", encoding="utf-8") as f:
+            f.write(page)
+
 def generate_index(output_dir="book_output"):
     # 1. Find all book directories
     book_dirs = [d for d in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, d))]
@@ -26,7 +44,9 @@ def generate_index(output_dir="book_output"):
                 print(f"Warning: Failed to load manifest for {book_id}: {e}")
         
         # 2. Generate Index for THIS Book
-        html_files = sorted(glob.glob(os.path.join(book_path, "chunk_*.html")))
+        render_body_chunks(book_path)
+        html_files = sorted(f for f in glob.glob(os.path.join(book_path, "chunk_*.html"))
+                            if not f.endswith(".body.html"))
         if not html_files:
             continue
             
@@ -46,15 +66,21 @@ def generate_index(output_dir="book_output"):
             
         book_title = book_id.replace("_", " ").title()
         
-        # Check for cover image
-        cover_url = ""
-        # Check standard extensions
-        possible_covers = glob.glob(os.path.join(book_path, "cover.*"))
-        cover_filename = os.path.basename(possible_covers[0]) if possible_covers else None
+        # Check for cover image: cover.json points into the shared asset store;
+        # books chunked before it have a cover.* file of their own
+        cover_src = None
+        cover_json = os.path.join(book_path, "cover.json")
+        if os.path.exists(cover_json):
+            with open(cover_json, "r", encoding="utf-8") as f:
+                cover_src = json.load(f)["src"]
+        else:
+            possible_covers = glob.glob(os.path.join(book_path, "cover.*"))
+            if possible_covers:
+                cover_src = f"/{book_id}/{os.path.basename(possible_covers[0])}"
         
         header_image_html = ""
-        if cover_filename:
-            header_image_html = f'<div class="book-header-image"><img src="{cover_filename}" alt="Book Cover"></div>'
+        if cover_src:
+            header_image_html = f'<div class="book-header-image"><img src="{cover_src}" alt="Book Cover"></div>'
 
         book_index_html = f"""
         <!DOCTYPE html>
@@ -165,8 +191,8 @@ def generate_index(output_dir="book_output"):
         
         # Add to main library list
         thumb_html = ""
-        if cover_filename:
-            thumb_html = f'<img src="{book_id}/{cover_filename}" alt="{book_title}" class="book-thumb">'
+        if cover_src:
+            thumb_html = f'<img src="{cover_src}" alt="{book_title}" class="book-thumb">'
             
         book_links += f"""
         <a href="{book_id}/" class="book-card">
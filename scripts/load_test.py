@@ -0,0 +1,248 @@
+"""
+Offline load test for the Cloud Function's daily_emailer.
+
+Seeds a store with thousands of active books (state plus gzip-compressed
+chunks, as upload_to_gcs.py would write them), then calls the real
+handler against it and a local SMTP sink (scripts/local_services.py).
+Latency and failure rates can be injected on both sides to see how the
+run behaves with a slow bucket or a flaky mail server before it meets
+the Cloud Functions timeout. Reports per-book latency percentiles, total
+wall time and store/SMTP call counts; exits non-zero when the run takes
+longer than --budget-s.
+
+    uv run scripts/load_test.py --books 5000
+    uv run scripts/load_test.py --books 5000 --smtp-latency-ms 200 --smtp-failure-rate 0.02
+    uv run scripts/load_test.py --books 1000 --backend fake-gcs --store-latency-ms 30 --sharded-state
+"""
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+import contextlib
+
+from local_services import FakeGCS, SMTPSink
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_ROOT)
+from src.object_store import open_store, MemoryStore
+from src.state_manager import STATE_FILE, _shard_name
+from src.mime_chunk import build_mime
+
+STORE_LOCATION = "load-test://store"
+
+class InstrumentedStore:
+    """Wraps a store: counts calls per method and injects latency and failures."""
+
+    def __init__(self, store, latency=0.0, failure_rate=0.0, seed=None):
+        self.store = store
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = {}
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return repr(self.store)
+
+    def _call(self, method, *args, **kwargs):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError(f"Injected store failure ({method} {args[0] if args else ''})")
+        return getattr(self.store, method)(*args, **kwargs)
+
+    def get(self, name):
+        return self._call("get", name)
+
+    def get_range(self, name, start, end):
+        return self._call("get_range", name, start, end)
+
+    def put(self, name, data, **kwargs):
+        return self._call("put", name, data, **kwargs)
+
+    def exists(self, name):
+        return self._call("exists", name)
+
+    def list(self, prefix=""):
+        return self._call("list", prefix)
+
+    def delete(self, name):
+        return self._call("delete", name)
+
+def seed(store, books, chunks, chunk_kb, chunk_format, sharded, packed_archive=False):
+    """Every book active and about to send chunk 1 of `chunks`."""
+    html = ("<html><body><div class=\"chapter\">"
+            + "<p>Call me Ishmael. Some years ago, never mind how long precisely.</p>" * (chunk_kb * 16)
+            + "</div></body></html>")
+    body = build_mime(html) if chunk_format == "eml" else html.encode("utf-8")
+    # Stored like upload_to_gcs.py stores them; one compressed body shared by every chunk
+    packed = gzip.compress(body, compresslevel=9, mtime=0)
+    content_type = "message/rfc822" if chunk_format == "eml" else "text/html; charset=utf-8"
+
+    state = {}
+    for i in range(books):
+        book_id = f"book_{i:05d}"
+        state[book_id] = {"active": True, "last_chunk_id": 0, "total_chunks": chunks, "chunk_format": chunk_format}
+        if packed_archive:
+            # One pack of gzip members, as html_chunker.py --pack writes it, named like upload_to_gcs.py names it
+            pack = packed * chunks
+            chunk_pack = f"chunks-{hashlib.sha256(pack).hexdigest()[:16]}.pack"
+            store.put(f"books/{book_id}/{chunk_pack}", pack, content_type="application/octet-stream")
+            state[book_id]["chunk_offsets"] = [i * len(packed) for i in range(chunks + 1)]
+            state[book_id]["chunk_pack"] = chunk_pack
+            chunks_to_store = 0
+        else:
+            chunks_to_store = chunks
+        for chunk_id in range(1, chunks_to_store + 1):
+            store.put(f"books/{book_id}/chunks/chunk_{chunk_id:03d}.{chunk_format}", packed,
+                      content_type=content_type, content_encoding="gzip")
+        if sharded:
+            store.put(_shard_name(book_id), json.dumps(state[book_id]).encode(), content_type="application/json",
+                      metadata={"active": "true"})
+    if not sharded:
+        store.put(STATE_FILE, json.dumps(state).encode(), content_type="application/json")
+    return len(packed)
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run(main, store, smtp, runs):
+    """Calls daily_emailer `runs` times; returns one result dict per run."""
+    latencies = []
+    lock = threading.Lock()
+    dispatch_book = main.dispatch_book
+
+    def timed_dispatch(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return dispatch_book(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    main.dispatch_book = timed_dispatch
+    results = []
+    try:
+        for _ in range(runs):
+            latencies.clear()
+            store.calls.clear()
+            smtp_before = (len(smtp.messages), smtp.connections, smtp.rejected)
+            start = time.perf_counter()
+            # The handler prints a line per book; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                body, status = main.daily_emailer(None)
+            wall = time.perf_counter() - start
+            lines = body.splitlines()
+            results.append({
+                "status": status,
+                "wall_s": wall,
+                "books": len(latencies),
+                "sent": sum("Sent chunk" in line for line in lines),
+                "finished": sum("Finished & Deactivated" in line for line in lines),
+                "errors": sum("Error" in line for line in lines),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p90_ms": percentile(latencies, 90) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": max(latencies, default=0) * 1000,
+                "store_calls": dict(store.calls),
+                "smtp_messages": len(smtp.messages) - smtp_before[0],
+                "smtp_connections": smtp.connections - smtp_before[1],
+                "smtp_rejected": smtp.rejected - smtp_before[2],
+            })
+    finally:
+        main.dispatch_book = dispatch_book
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test daily_emailer offline against local store and SMTP stand-ins.")
+    parser.add_argument("--books", type=int, default=5000, help="Active books to seed")
+    parser.add_argument("--chunks", type=int, default=2, help="Chunks per book (the last run finishes books)")
+    parser.add_argument("--chunk-kb", type=int, default=60, help="Approximate size of each chunk's HTML")
+    parser.add_argument("--format", choices=["html", "eml"], default="html", help="Stored chunk format")
+    parser.add_argument("--backend", choices=["memory", "fake-gcs"], default="memory",
+                        help="In-process MemoryStore, or the real GCS client against the local FakeGCS over HTTP")
+    parser.add_argument("--packed", action="store_true", help="Seed one chunk pack per book (ranged reads)")
+    parser.add_argument("--sharded-state", action="store_true", help="Seed per-book state objects instead of sending_state.json")
+    parser.add_argument("--concurrency", type=int, help="DISPATCH_CONCURRENCY for the run (default: main.py's)")
+    parser.add_argument("--store-latency-ms", type=float, default=0.0, help="Added to every store call")
+    parser.add_argument("--store-failure-rate", type=float, default=0.0, help="Share of store calls that raise")
+    parser.add_argument("--smtp-latency-ms", type=float, default=0.0, help="Added to every accepted message")
+    parser.add_argument("--smtp-failure-rate", type=float, default=0.0, help="Share of messages the SMTP sink rejects")
+    parser.add_argument("--runs", type=int, default=1, help="Consecutive daily runs against the same store")
+    parser.add_argument("--budget-s", type=float, default=60.0,
+                        help="Fail if a run takes longer (the deployed function's default timeout is 60 s)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for injected failures")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    gcs = None
+    if args.backend == "fake-gcs":
+        gcs = FakeGCS().start()
+        os.environ["STORAGE_EMULATOR_HOST"] = gcs.url
+        backend = open_store("gs://load-test")
+    else:
+        backend = MemoryStore()
+    smtp = SMTPSink(latency=args.smtp_latency_ms / 1000, failure_rate=args.smtp_failure_rate, seed=args.seed).start()
+
+    print(f"Seeding {args.books} books x {args.chunks} chunks ({args.format}, {backend})...")
+    start = time.perf_counter()
+    packed = seed(backend, args.books, args.chunks, args.chunk_kb, args.format, args.sharded_state,
+                  args.packed)
+    print(f"Seeded in {time.perf_counter() - start:.1f} s ({packed / 1024:.1f} KB per stored chunk)")
+
+    # Injected faults only apply to the handler, not to seeding
+    store = InstrumentedStore(backend, args.store_latency_ms / 1000, args.store_failure_rate, seed=args.seed)
+    os.environ.update(
+        # Mirror the deployed runtime (no .env lookup) and point it at the stand-ins
+        K_SERVICE="load-test",
+        OBJECT_STORE=STORE_LOCATION,
+        TARGET_EMAIL="reader@example.com",
+        GMAIL_USER="sender@example.com",
+        GMAIL_APP_PASSWORD="load-test",
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(smtp.port),
+        SMTP_STARTTLS="0")
+    if args.concurrency:
+        os.environ["DISPATCH_CONCURRENCY"] = str(args.concurrency)
+
+    import main
+    main._stores[STORE_LOCATION] = store
+    results = run(main, store, smtp, args.runs)
+
+    over_budget = False
+    for i, r in enumerate(results, 1):
+        calls = ", ".join(f"{method} {count}" for method, count in sorted(r["store_calls"].items()))
+        print(f"\nRun {i}: HTTP {r['status']} in {r['wall_s']:.2f} s "
+              f"({r['books'] / r['wall_s'] if r['wall_s'] else 0:.0f} books/s)")
+        print(f"  books: {r['books']} dispatched, {r['sent']} sent, {r['finished']} finished, {r['errors']} errors")
+        print(f"  per-book latency: p50 {r['p50_ms']:.1f} ms, p90 {r['p90_ms']:.1f} ms, "
+              f"p99 {r['p99_ms']:.1f} ms, max {r['max_ms']:.1f} ms")
+        print(f"  store calls: {calls or 'none'}")
+        print(f"  SMTP: {r['smtp_messages']} messages, {r['smtp_connections']} connections, {r['smtp_rejected']} rejected")
+        if r["wall_s"] > args.budget_s:
+            over_budget = True
+            print(f"  OVER BUDGET: {r['wall_s']:.1f} s > {args.budget_s:.0f} s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": results}, f, indent=2)
+
+    smtp.stop()
+    if gcs:
+        gcs.stop()
+    sys.exit(1 if over_budget else 0)
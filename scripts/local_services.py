@@ -0,0 +1,281 @@
+"""
+In-process stand-ins for the services the Cloud Function talks to, so it
+can be exercised offline by the benchmark and load-test scripts.
+
+- FakeGCS: a small subset of the GCS JSON API (media download with Range,
+  object metadata (including custom metadata), listing, multipart upload
+  with generation preconditions, delete). Point google-cloud-storage at it with
+  STORAGE_EMULATOR_HOST=fake_gcs.url.
+- SMTPSink: accepts EHLO/AUTH/MAIL/RCPT/DATA and keeps the messages.
+  latency (seconds per accepted message) and failure_rate (share of
+  messages answered with failure_reply, a 451 by default) simulate a slow
+  or flaky server.
+
+Both run on daemon threads; call start() and stop().
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import time
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+class FakeGCS:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.objects = {}  # (bucket, name) -> {"data", "generation", "content_type", "content_encoding", "metadata"}
+        self.requests = []  # (method, path) of every request, for counting round trips
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def put(self, bucket, name, data, content_type="application/octet-stream", content_encoding=None, metadata=None):
+        """Stores an object directly (test setup); returns its generation."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            self._generation += 1
+            self.objects[(bucket, name)] = {"data": data, "generation": self._generation,
+                                            "content_type": content_type, "content_encoding": content_encoding,
+                                            "metadata": metadata}
+            return self._generation
+
+    def get(self, bucket, name):
+        obj = self.objects.get((bucket, name))
+        return obj["data"] if obj else None
+
+    def _resource(self, bucket, name, obj):
+        resource = {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "generation": str(obj["generation"]),
+            "metageneration": "1",
+            "size": str(len(obj["data"])),
+            "contentType": obj["content_type"],
+            "md5Hash": base64.b64encode(hashlib.md5(obj["data"]).digest()).decode(),
+        }
+        if obj["content_encoding"]:
+            resource["contentEncoding"] = obj["content_encoding"]
+        if obj.get("metadata"):
+            resource["metadata"] = obj["metadata"]
+        return resource
+
+    def _handler(self):
+        gcs = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b"", content_type="application/json", headers=None):
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, status, message):
+                self._reply(status, {"error": {"code": status, "message": message}})
+
+            def _route(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with gcs._lock:
+                    gcs.requests.append((self.command, url.path))
+                match = re.match(r"^/(?:download/|upload/)?storage/v1/b/([^/]+)/o(?:/(.+))?$", url.path)
+                if not match:
+                    return None, None, query
+                return match.group(1), unquote(match.group(2)) if match.group(2) else None, query
+
+            def _precondition_failed(self, obj, query):
+                if "ifGenerationMatch" not in query:
+                    return False
+                current = obj["generation"] if obj else 0
+                return int(query["ifGenerationMatch"]) != current
+
+            def do_GET(self):
+                bucket, name, query = self._route()
+                if bucket is None:
+                    # Bucket metadata (client.get_bucket); any bucket name exists
+                    match = re.match(r"^/storage/v1/b/([^/?]+)$", urlparse(self.path).path)
+                    if match:
+                        return self._reply(200, {"kind": "storage#bucket", "name": match.group(1)})
+                    return self._error(404, "Not Found")
+
+                if name is None:
+                    # List objects
+                    prefix = query.get("prefix", "")
+                    items = [gcs._resource(b, n, obj) for (b, n), obj in sorted(gcs.objects.items())
+                             if b == bucket and n.startswith(prefix)]
+                    return self._reply(200, {"kind": "storage#objects", "items": items})
+
+                obj = gcs.objects.get((bucket, name))
+                if obj is None:
+                    return self._error(404, f"No such object: {bucket}/{name}")
+                if self._precondition_failed(obj, query):
+                    return self._error(412, "Precondition Failed")
+
+                if query.get("alt") != "media":
+                    return self._reply(200, gcs._resource(bucket, name, obj))
+
+                data = obj["data"]
+                headers = {"X-Goog-Generation": str(obj["generation"]), "X-Goog-Metageneration": "1"}
+                if obj["content_encoding"]:
+                    headers["Content-Encoding"] = obj["content_encoding"]
+                byte_range = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if byte_range:
+                    start = int(byte_range.group(1))
+                    end = int(byte_range.group(2)) if byte_range.group(2) else len(data) - 1
+                    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                    return self._reply(206, data[start:end + 1], obj["content_type"], headers)
+                headers["X-Goog-Hash"] = f"md5={gcs._resource(bucket, name, obj)['md5Hash']}"
+                return self._reply(200, data, obj["content_type"], headers)
+
+            def do_POST(self):
+                bucket, name, query = self._route()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if bucket is None or query.get("uploadType") != "multipart":
+                    return self._error(400, "Only multipart uploads are supported")
+
+                # multipart/related: JSON metadata part, then the media part (raw bytes)
+                boundary = re.search(r'boundary="?([^";]+)"?', self.headers["Content-Type"]).group(1)
+                parts = body.split(b"--" + boundary.encode())[1:3]
+                (_, metadata), (media_headers, data) = [p.split(b"\r\n\r\n", 1) for p in parts]
+                metadata = json.loads(metadata)
+                data = data[:-2] if data.endswith(b"\r\n") else data
+                media_type = re.search(rb"(?i)content-type:\s*([^\r\n]+)", media_headers)
+                name = metadata.get("name") or query.get("name")
+
+                with gcs._lock:
+                    obj = gcs.objects.get((bucket, name))
+                    if self._precondition_failed(obj, query):
+                        return self._error(412, "Precondition Failed")
+                    gcs._generation += 1
+                    obj = {"data": data, "generation": gcs._generation,
+                           "content_type": metadata.get("contentType") or (media_type and media_type.group(1).decode()),
+                           "content_encoding": metadata.get("contentEncoding"),
+                           "metadata": metadata.get("metadata")}
+                    gcs.objects[(bucket, name)] = obj
+                self._reply(200, gcs._resource(bucket, name, obj))
+
+            def do_DELETE(self):
+                bucket, name, query = self._route()
+                with gcs._lock:
+                    if gcs.objects.pop((bucket, name), None) is None:
+                        return self._error(404, "Not Found")
+                self._reply(204)
+
+        return Handler
+
+class SMTPSink:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, seed=None,
+                 failure_reply="451 4.3.0 Temporary failure, try again later"):
+        self.messages = []  # (mail_from, [rcpt, ...], data)
+        self.connections = 0
+        self.commands = {}  # verb -> count
+        self.rejected = 0
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_reply = failure_reply
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                self.reply("220 localhost SMTP sink")
+                mail_from, rcpts = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    with sink._lock:
+                        sink.commands[verb] = sink.commands.get(verb, 0) + 1
+
+                    if verb in ("EHLO", "HELO"):
+                        self.reply("250-localhost")
+                        self.reply("250-AUTH PLAIN LOGIN")
+                        self.reply("250 8BITMIME")
+                    elif verb == "AUTH":
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif verb == "MAIL":
+                        mail_from, rcpts = command[10:].strip("<> "), []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        rcpts.append(command[8:].strip("<> "))
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            line = self.rfile.readline()
+                            if not line or line in (b".\r\n", b".\n"):
+                                break
+                            # Undo dot-stuffing
+                            data.append(line[1:] if line.startswith(b"..") else line)
+                        if sink.latency:
+                            time.sleep(sink.latency)
+                        with sink._lock:
+                            rejected = sink.failure_rate and sink._random.random() < sink.failure_rate
+                            if rejected:
+                                sink.rejected += 1
+                            else:
+                                sink.messages.append((mail_from, rcpts, b"".join(data)))
+                        if rejected:
+                            self.reply(sink.failure_reply)
+                        else:
+                            self.reply("250 OK: queued")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        return Handler
@@ -1,63 +1,197 @@
 import os
+import re
+import sys
+import json
 import argparse
 import glob
-from google.cloud import storage
+import gzip
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-def upload_chunks(bucket_name, source_dir="book_output"):
+# Add src to path so we can import state_manager
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from object_store import open_store
+from state_manager import open_state_session
+
+def prepare_file(local_path, compress=True):
     """
-    Uploads all HTML chunks from source_dir to gs://bucket_name/chunks/
+    Returns (bytes as stored, content_encoding): gzip-compressed with
+    Content-Encoding: gzip unless compress is False. mtime=0 keeps the
+    compressed bytes reproducible, so unchanged files keep the same MD5.
     """
-    client = storage.Client()
-    try:
-        bucket = client.get_bucket(bucket_name)
-    except Exception:
-        print(f"Bucket {bucket_name} not found. Please create it first.")
-        return
+    with open(local_path, "rb") as f:
+        data = f.read()
+    if compress:
+        return gzip.compress(data, compresslevel=9, mtime=0), "gzip"
+    return data, None
+
+def sync_file(store, blob_name, local_path, content_type, compress=True, remote_md5=None):
+    """
+    Uploads a file unless the remote object already holds the same bytes
+    (remote_md5 is the base64 MD5 from the listing). Returns (uploaded, size).
+    """
+    data, content_encoding = prepare_file(local_path, compress)
+    if remote_md5 == base64.b64encode(hashlib.md5(data).digest()).decode():
+        return False, len(data)
+    store.put(blob_name, data, content_type=content_type, content_encoding=content_encoding)
+    return True, len(data)
 
-    print(f"Uploading to gs://{bucket_name}/...")
+def pack_blob_name(local_path):
+    """
+    chunks-<sha256[:16]>.pack: a rebuilt pack gets a new object instead of
+    overwriting the one the current state's offsets point into.
+    """
+    sha = hashlib.sha256()
+    with open(local_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return f"chunks-{sha.hexdigest()[:16]}.pack"
+
+def upload_chunks(store, source_dir="book_output", compress=True, jobs=8, delete_orphans=False):
+    """
+    Syncs all chunks from source_dir to <store>/books/<book_id>/chunks/.
+    store is an object_store backend or a location (bucket name, gs://..., directory).
+    The remote prefix is listed once; only files whose stored bytes differ
+    are uploaded, jobs at a time.
+    """
+    store = open_store(store)
+    print(f"Syncing to {store}/...")
     
     # 1. Identify Books from book_output directory
     if not os.path.exists(source_dir):
         print(f"Directory {source_dir} not found.")
         return
 
-    book_ids = [d for d in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, d))]
+    # assets/ (shared images and covers) is only served by Firebase Hosting
+    book_ids = [d for d in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, d)) and d != "assets"]
     
     if not book_ids:
         print("No book directories found in book_output/")
         return
 
+    # One listing gives the MD5 of everything already uploaded
+    remote = {info.name: info.md5_hash for info in store.list("books/")}
+
+    # Chunk counts are recorded in state so the Cloud Function can tell a
+    # finished book without probing GCS (one state write for all books; only
+    # the local books' state is read)
+    session = open_state_session(store, books=book_ids)
+
+    uploads = []  # (blob_name, local_path, content_type, compress)
+    orphans = []
     for book_id in book_ids:
-        print(f"--- Processing {book_id} ---")
         book_dir = os.path.join(source_dir, book_id)
+        manifest_path = os.path.join(book_dir, "manifest.json")
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
         
-        # A. Upload Chunks
-        files = [f for f in os.listdir(book_dir) if f.endswith(".html")]
+        # A. Chunks (and their pre-built MIME bodies, if built with --mime)
+        files = [f for f in os.listdir(book_dir) if f.endswith((".html", ".eml"))]
+        # Body-only chunks (chunk_XXX.body.html) are uploaded in place of their
+        # rendered copies, which only exist for Firebase Hosting
+        body_chunks = {f.replace(".body.html", ".html") for f in files if f.endswith(".body.html")}
+        # Books built with --pack upload one archive (already gzip members) instead of loose chunks
+        packed = os.path.exists(os.path.join(book_dir, "chunks.pack"))
+        if packed and not (manifest and "pack_offset" in manifest[0]):
+            print(f"Warning: {book_id}/chunks.pack has no offsets in manifest.json, uploading loose chunks instead")
+            packed = False
+        chunk_blobs = set()
+        chunk_pack = None
+        if packed:
+            chunk_pack = pack_blob_name(os.path.join(book_dir, "chunks.pack"))
+            uploads.append((f"books/{book_id}/{chunk_pack}", os.path.join(book_dir, "chunks.pack"),
+                            "application/octet-stream", False))
         for filename in files:
-            local_path = os.path.join(book_dir, filename)
+            if packed or filename in body_chunks:
+                continue
             # GCS Path: books/<book_id>/chunks/<filename>
-            blob_name = f"books/{book_id}/chunks/{filename}"
-            
-            blob = bucket.blob(blob_name)
-            blob.upload_from_filename(local_path)
-            print(f"Uploading {filename} -> gs://{bucket_name}/{blob_name}")
+            blob_name = f"books/{book_id}/chunks/{filename.replace('.body.html', '.html')}"
+            content_type = "message/rfc822" if filename.endswith(".eml") else "text/html; charset=utf-8"
+            uploads.append((blob_name, os.path.join(book_dir, filename), content_type, compress))
+            chunk_blobs.add(blob_name)
+
+        # Chunks and packs left over from an earlier build (fewer chunks now, a different format, a rebuilt pack)
+        chunk_prefix = f"books/{book_id}/chunks/"
+        orphans += sorted(name for name in remote if name.startswith(chunk_prefix) and name not in chunk_blobs)
+        pack_re = re.compile(rf"books/{re.escape(book_id)}/chunks(-[0-9a-f]{{16}})?\.pack")
+        orphans += sorted(name for name in remote
+                          if pack_re.fullmatch(name) and name != f"books/{book_id}/{chunk_pack}")
+
+        # B. Manifest, and the chunk count (plus pack offsets) for state
+        chunk_offsets = None
+        if manifest is not None:
+            total_chunks = len(manifest)
+            if packed:
+                # chunk N is bytes chunk_offsets[N-1] up to chunk_offsets[N] of the pack
+                chunk_offsets = [entry["pack_offset"] for entry in manifest]
+                chunk_offsets.append(manifest[-1]["pack_offset"] + manifest[-1]["pack_length"])
+            uploads.append((f"books/{book_id}/manifest.json", manifest_path, "application/json", compress))
+        else:
+            total_chunks = len({f.replace(".body.html", ".html") for f in files
+                                if f.startswith("chunk_") and f.endswith(".html")})
+        # The Cloud Function sends .eml bodies as-is when a book has them
+        chunk_format = "eml" if any(f.endswith(".eml") for f in files) else "html"
+        book_state = session.state.get(book_id, {})
+        if (book_state.get("total_chunks") != total_chunks or book_state.get("chunk_format") != chunk_format
+                or book_state.get("chunk_offsets") != chunk_offsets or book_state.get("chunk_pack") != chunk_pack):
+            # The pack's name and its offsets change together, in one state write
+            session.update(book_id, total_chunks=total_chunks, chunk_format=chunk_format, chunk_offsets=chunk_offsets,
+                           chunk_pack=chunk_pack)
             
-        # B. Upload EPUB
+        # C. EPUB
         # Assuming local epub is at books/<book_id>.epub
         epub_local = f"books/{book_id}.epub"
         if os.path.exists(epub_local):
-            blob_name = f"books/{book_id}/ebook.epub"
-            blob = bucket.blob(blob_name)
-            blob.upload_from_filename(epub_local)
-            print(f"Uploading {epub_local} -> gs://{bucket_name}/{blob_name}")
+            uploads.append((f"books/{book_id}/ebook.epub", epub_local, "application/epub+zip", False))
         else:
             print(f"Warning: {epub_local} not found, skipping EPUB upload.")
 
-    print("Upload complete!")
+    # 2. Transfer whatever changed, in parallel (compression runs in the workers too)
+    def sync(item):
+        blob_name, local_path, content_type, compress_file = item
+        return sync_file(store, blob_name, local_path, content_type, compress_file, remote.get(blob_name))
+
+    totals = {"uploaded": 0, "uploaded_bytes": 0, "skipped": 0, "skipped_bytes": 0}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for (blob_name, local_path, _, _), (uploaded, size) in zip(uploads, executor.map(sync, uploads)):
+            key = "uploaded" if uploaded else "skipped"
+            totals[key] += 1
+            totals[f"{key}_bytes"] += size
+            if uploaded:
+                print(f"Uploading {os.path.basename(local_path)} -> {store}/{blob_name} ({size} bytes)")
+
+    # 3. State points at the new objects before anything old is removed
+    session.commit()
+
+    # 4. Orphaned chunks and packs: removed only on request, otherwise just reported
+    if orphans:
+        if delete_orphans:
+            with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+                list(executor.map(store.delete, orphans))
+            for name in orphans:
+                print(f"Deleted orphan {store}/{name}")
+        else:
+            print(f"{len(orphans)} remote chunk(s) or pack(s) no longer built locally; "
+                  "pass --delete-orphans to remove them")
+
+    print(f"Sync complete: {totals['uploaded']} object(s) uploaded ({totals['uploaded_bytes'] / 1024:.1f} KB), "
+          f"{totals['skipped']} unchanged ({totals['skipped_bytes'] / 1024:.1f} KB skipped)"
+          + (f", {len(orphans)} orphan(s) deleted" if orphans and delete_orphans else ""))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Upload chunks to GCS")
-    parser.add_argument("--bucket", required=True, help="Target GCS bucket name")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--bucket", help="Target GCS bucket name")
+    target.add_argument("--store", help="Any object store location instead: gs://<bucket> or a local directory")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="Upload chunks and manifests as-is instead of gzip-compressed")
+    parser.add_argument("--jobs", type=int, default=8, help="Parallel uploads (default 8)")
+    parser.add_argument("--delete-orphans", action="store_true",
+                        help="Delete remote chunks and packs of local books that are no longer built (e.g. after re-chunking)")
     args = parser.parse_args()
     
-    upload_chunks(args.bucket)
+    upload_chunks(f"gs://{args.bucket}" if args.bucket else args.store, compress=not args.no_compress,
+                  jobs=args.jobs, delete_orphans=args.delete_orphans)
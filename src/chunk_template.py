@@ -0,0 +1,160 @@
+"""
+The email/web page shell wrapped around every chunk body.
+
+The template is split into static segments once at import time, so
+rendering a chunk is a single join. Chunks can also be stored as just
+their body plus a small metadata comment (see dump_body_chunk); the shell
+is then applied when the chunk is sent or published, so template changes
+don't require re-chunking any book. This module has no dependencies so
+both the chunker and the Cloud Function can import it.
+"""
+import json
+from string import Template
+
+# Bump whenever the shell's markup changes so cached books get rebuilt
+TEMPLATE_VERSION = 1
+
+BODY_META_PREFIX = "<!-- ishmael-chunk "
+BODY_META_SUFFIX = " -->\n"
+
+CHUNK_TEMPLATE = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <style>
+            body {
+                margin: 0;
+                padding: 0;
+                background-color: #fdf6e3; 
+                font-family: Georgia, serif; 
+            }
+            .container {
+                max-width: 550px; 
+                margin: 0 auto; 
+                padding: 40px 20px;
+                background-color: #ffffff;
+                color: #333; 
+                line-height: 1.6; 
+                font-size: 18px;
+                border-radius: 8px; /* Optional: adds a slight card effect */
+                box-shadow: 0 2px 5px rgba(0,0,0,0.05); /* Optional: subtle shadow */
+            }
+            /* Specific for dark mode readers if needed, but keeping it simple for now */
+            h1, h2, h3 { color: #2c3e50; margin-top: 0; }
+            .footer { 
+                margin-top: 40px; 
+                font-size: 0.8em; 
+                color: #888; 
+                border-top: 1px solid #eee; 
+                padding-top: 20px; 
+                text-align: center;
+            }
+            .footer p { margin: 5px 0; }
+            .footer a {
+                color: #888;
+                text-decoration: underline;
+            }
+            .book-title a {
+                color: #2c3e50;
+                text-decoration: none;
+            }
+            .book-title a:hover {
+                text-decoration: underline;
+            }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+             <h2 class="book-title"><a href="${index_url}">${book_title}</a> <span style="font-size:0.6em; color:#777; font-weight: normal;">(Part ${chunk_id} of ${total_chunks}${chapter_info})</span></h2>
+            
+            $body
+            
+            <div class="footer">
+                <p>End of Part ${chunk_id}. Next part arrives tomorrow.</p>
+                <p><a href="${hosting_url}">Read this part online</a> | ${footer_link}</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+def _compile(template_text):
+    """Splits a $-placeholder template into (static segments, field names)."""
+    segments, fields = [], []
+    last = 0
+    for match in Template.pattern.finditer(template_text):
+        name = match.group("named") or match.group("braced")
+        if not name:
+            raise ValueError(f"Unsupported placeholder {match.group(0)!r} in chunk template")
+        segments.append(template_text[last:match.start()])
+        fields.append(name)
+        last = match.end()
+    segments.append(template_text[last:])
+    return segments, fields
+
+_SEGMENTS, _FIELDS = _compile(CHUNK_TEMPLATE)
+
+def render_html_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id, chapter_list=None, next_chunk_id=None):
+    """Wraps the raw paragraphs in a nice HTML email template."""
+
+    # Firebase Hosting URLs
+    index_url = f"https://call-me-ishmael.web.app/{book_id}/"
+    hosting_url = f"https://call-me-ishmael.web.app/{book_id}/chunk_{chunk_id:03d}"
+
+    if next_chunk_id:
+        next_url = f"https://call-me-ishmael.web.app/{book_id}/chunk_{next_chunk_id:03d}"
+        footer_link = f'<a href="{next_url}">Jump to tomorrow\'s part</a>'
+    else:
+        footer_link = "<span>End of Book</span>"
+
+    # Format chapter info
+    chapter_info = ""
+    if chapter_list:
+        joined_chapters = ", ".join(chapter_list)
+        chapter_info = f", covering: {joined_chapters}"
+
+    values = {
+        "index_url": index_url,
+        "book_title": book_title,
+        "chunk_id": chunk_id,
+        "total_chunks": total_chunks,
+        "chapter_info": chapter_info,
+        "body": "".join(content_blocks),
+        "hosting_url": hosting_url,
+        "footer_link": footer_link,
+    }
+    parts = [_SEGMENTS[0]]
+    for field, segment in zip(_FIELDS, _SEGMENTS[1:]):
+        parts.append(str(values[field]))
+        parts.append(segment)
+    return "".join(parts)
+
+def dump_body_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id, chapter_list=None, next_chunk_id=None):
+    """Serializes a chunk as a metadata comment followed by its body only."""
+    meta = {
+        "chunk_id": chunk_id,
+        "total_chunks": total_chunks,
+        "book_title": book_title,
+        "book_id": book_id,
+        "chapter_list": chapter_list,
+        "next_chunk_id": next_chunk_id,
+    }
+    # '>' only occurs inside JSON strings, so escaping it keeps "-->" out of the comment
+    meta_json = json.dumps(meta, ensure_ascii=False).replace(">", "\\u003e")
+    return BODY_META_PREFIX + meta_json + BODY_META_SUFFIX + "".join(content_blocks)
+
+def is_body_chunk(text):
+    return text.startswith(BODY_META_PREFIX)
+
+def render_stored_chunk(text):
+    """
+    Returns a sendable page for a stored chunk: body-only chunks get the
+    current shell applied, full pages are returned unchanged.
+    """
+    if not is_body_chunk(text):
+        return text
+    meta_end = text.index(BODY_META_SUFFIX)
+    meta = json.loads(text[len(BODY_META_PREFIX):meta_end])
+    body = text[meta_end + len(BODY_META_SUFFIX):]
+    return render_html_chunk([body], **meta)
@@ -1,52 +1,185 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from dotenv import load_dotenv
+import threading
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env when running locally. Cloud Run / Cloud Functions
+# set K_SERVICE and get their variables from the deployment, so skip the file lookup there.
+if not os.getenv('K_SERVICE'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
-def send_chunk_email(to_email, subject, html_content):
-    """
-    Sends an HTML email using Gmail SMTP.
-    """
-    gmail_user = os.getenv('GMAIL_USER')
-    gmail_password = os.getenv('GMAIL_APP_PASSWORD')
-    
-    if not gmail_user or not gmail_password:
-        raise ValueError("GMAIL_USER and GMAIL_APP_PASSWORD must be set in .env file")
-
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = gmail_user
-    
+def _session_dropped(error):
+    """True for errors after which the send is worth retrying on a fresh session."""
+    import smtplib  # already loaded by the session that raised
+
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # 421: the server is closing the connection (idle timeout, too many messages)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421
+    # Socket errors (reset, timeout). SMTPException subclasses OSError too, so any other
+    # SMTP error (a refused message or recipient, failed auth) is final
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+def _recipients(to_email):
     # Handle multiple recipients
     if isinstance(to_email, str):
         if ';' in to_email:
-            recipients = [e.strip() for e in to_email.split(';')]
+            return [e.strip() for e in to_email.split(';')]
         elif ',' in to_email:
-            recipients = [e.strip() for e in to_email.split(',')]
-        else:
-            recipients = [to_email]
-    else:
-        recipients = to_email
-        
-    msg['To'] = ", ".join(recipients)
-
-    # Attach HTML content
-    part = MIMEText(html_content, 'html')
-    msg.attach(part)
+            return [e.strip() for e in to_email.split(',')]
+        return [to_email]
+    return to_email
+
+class Mailer:
+    """
+    Keeps authenticated SMTP sessions open and sends many messages over
+    them. Sessions are pooled, so concurrent senders each get their own
+    without paying EHLO/STARTTLS/login per message; a session that was
+    dropped by the server is replaced and the message resent once.
+
+    Defaults to Gmail; SMTP_HOST, SMTP_PORT and SMTP_STARTTLS=0 point it
+    at another server, e.g. a local stand-in for testing.
+    """
+
+    def __init__(self, user=None, password=None, host=None, port=None, starttls=None, timeout=30):
+        self.user = user or os.getenv('GMAIL_USER')
+        self.password = password or os.getenv('GMAIL_APP_PASSWORD')
+        if not self.user or not self.password:
+            raise ValueError("GMAIL_USER and GMAIL_APP_PASSWORD must be set in .env file")
+
+        self.host = host or os.getenv('SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(port or os.getenv('SMTP_PORT', 587))
+        if starttls is None:
+            starttls = os.getenv('SMTP_STARTTLS', '1') != '0'
+        self.starttls = starttls
+        self.timeout = timeout
+
+        self.connections = 0  # sessions opened so far, for logging/tests
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        # smtplib (and the email/ssl modules it pulls in) is only loaded once a message is sent
+        import smtplib
+
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self._lock:
+            self.connections += 1
+        return server
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, server):
+        with self._lock:
+            self._idle.append(server)
+
+    def send_message(self, recipients, message):
+        """Sends an already-built message string to a list of recipients."""
+        for attempt in (1, 2):
+            server = self._acquire()
+            try:
+                server.sendmail(self.user, recipients, message)
+            except Exception as e:
+                # Unknown session state after any failure (e.g. a refused message); don't reuse it
+                server.close()
+                if attempt == 2 or not _session_dropped(e):
+                    raise
+                print("SMTP session dropped, reconnecting")
+                continue
+            self._release(server)
+            return
+
+    def send(self, to_email, subject, html_content):
+        # email.mime pulls in the header parser/policy machinery; only load it when sending
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+
+        recipients = _recipients(to_email)
+
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.user
+        msg['To'] = ", ".join(recipients)
+
+        # Attach HTML content
+        part = MIMEText(html_content, 'html')
+        msg.attach(part)
+
+        self.send_message(recipients, msg.as_string())
+
+    def send_raw(self, to_email, subject, mime_body):
+        """
+        Sends a pre-built MIME body (bytes from mime_chunk.build_mime) as-is,
+        prepending only the addressing headers.
+        """
+        from email.header import Header
+        from email.utils import formatdate, make_msgid
+
+        recipients = _recipients(to_email)
+        if not subject.isascii():
+            subject = Header(subject, 'utf-8').encode()
+        headers = (f"From: {self.user}\r\n"
+                   f"To: {', '.join(recipients)}\r\n"
+                   f"Subject: {subject}\r\n"
+                   f"Date: {formatdate(localtime=True)}\r\n"
+                   f"Message-ID: {make_msgid()}\r\n")
+        self.send_message(recipients, headers.encode("utf-8") + mime_body)
+
+    def close(self):
+        import smtplib
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+def send_chunk_email(to_email, subject, html_content, mailer=None):
+    """
+    Sends an HTML email using Gmail SMTP. Pass a Mailer to reuse its
+    sessions; without one a session is opened just for this message.
+    """
+    if mailer is None:
+        with Mailer() as one_shot:
+            return send_chunk_email(to_email, subject, html_content, mailer=one_shot)
+
+    try:
+        mailer.send(to_email, subject, html_content)
+        print(f"Email sent successfully to {to_email}")
+        return True
+    except Exception as e:
+        print(f"Failed to send email: {e}")
+        raise e
+
+def send_chunk_mime(to_email, subject, mime_body, mailer=None):
+    """Like send_chunk_email, for a chunk stored as a pre-built MIME body (.eml)."""
+    if mailer is None:
+        with Mailer() as one_shot:
+            return send_chunk_mime(to_email, subject, mime_body, mailer=one_shot)
 
     try:
-        # Connect to Gmail SMTP
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.ehlo()
-        server.starttls()
-        server.login(gmail_user, gmail_password)
-        
-        server.sendmail(gmail_user, recipients, msg.as_string())
-        server.close()
+        mailer.send_raw(to_email, subject, mime_body)
         print(f"Email sent successfully to {to_email}")
         return True
     except Exception as e:
@@ -0,0 +1,190 @@
+import posixpath
+import zipfile
+from urllib.parse import unquote
+
+import ebooklib
+from ebooklib.epub import NAMESPACES, IMAGE_MEDIA_TYPES, EpubException
+from ebooklib.utils import parse_string, parse_html_string
+from lxml import etree
+
+class EpubMember:
+    """
+    One manifest item. Bytes are read from the archive only when asked for
+    and are not kept, so large images and fonts never sit in memory.
+    Mirrors the parts of ebooklib's EpubItem API that the chunker uses.
+    """
+
+    def __init__(self, archive, uid, file_name, media_type, item_type):
+        self._archive = archive
+        self.id = uid
+        self.file_name = file_name
+        self.media_type = media_type
+        self.item_type = item_type
+
+    def get_id(self):
+        return self.id
+
+    def get_name(self):
+        return self.file_name
+
+    def get_type(self):
+        return self.item_type
+
+    def open(self):
+        """Returns a file-like object streaming this member out of the zip."""
+        return self._archive.open_member(self.file_name)
+
+    def get_content(self):
+        return self._archive.read_member(self.file_name)
+
+    def get_body_content(self):
+        """Same contract as ebooklib's EpubHtml.get_body_content()."""
+        try:
+            html_tree = parse_html_string(self.get_content())
+        except Exception:
+            return b""
+
+        body = html_tree.find("body")
+        if body is None or len(body) == 0:
+            return b""
+
+        tree_str = etree.tostring(body, pretty_print=True, encoding="utf-8", xml_declaration=False)
+        if tree_str.startswith(b"<body>"):
+            return tree_str[6:tree_str.rindex(b"</body>")]
+        return tree_str
+
+class LazyEpub:
+    """
+    Reads only META-INF/container.xml and the OPF package document up front.
+    The manifest is indexed by id and href; member bytes are decompressed on
+    demand. Use as a context manager so the zip handle gets closed.
+    """
+
+    def __init__(self, epub_path):
+        self.epub_path = epub_path
+        try:
+            self._zip = zipfile.ZipFile(epub_path, "r")
+        except zipfile.BadZipFile:
+            raise EpubException(0, "Bad Zip file")
+
+        self.metadata = {}
+        self.items = []
+        self._by_id = {}
+        self._by_href = {}
+        self.spine = []
+
+        try:
+            self._load_package()
+        except Exception:
+            self._zip.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def open_member(self, file_name):
+        return self._zip.open(posixpath.normpath(posixpath.join(self.opf_dir, file_name)))
+
+    def read_member(self, file_name):
+        return self._zip.read(posixpath.normpath(posixpath.join(self.opf_dir, file_name)))
+
+    def _load_package(self):
+        container = parse_string(self._zip.read("META-INF/container.xml"))
+        opf_file = None
+        for root_file in container.findall(".//xmlns:rootfile[@media-type]",
+                                           namespaces={"xmlns": NAMESPACES["CONTAINERNS"]}):
+            if root_file.get("media-type") == "application/oebps-package+xml":
+                opf_file = root_file.get("full-path")
+        if opf_file is None:
+            raise EpubException(-1, "Can not find container file")
+        self.opf_dir = posixpath.dirname(opf_file)
+
+        package = parse_string(self._zip.read(opf_file))
+        self._load_metadata(package)
+        self._load_manifest(package)
+
+        spine = package.find("{%s}spine" % NAMESPACES["OPF"])
+        if spine is not None:
+            self.spine = [r.get("idref") for r in spine if r.get("idref")]
+
+    def _load_metadata(self, package):
+        # Same shape as ebooklib: {namespace: {name: [(value, attributes), ...]}}
+        metadata = package.find("{%s}metadata" % NAMESPACES["OPF"])
+        if metadata is None:
+            return
+        default_ns = metadata.nsmap.get(None, "")
+
+        for t in metadata:
+            if not etree.iselement(t) or t.tag is etree.Comment:
+                continue
+            if t.tag == default_ns + "meta":
+                name = t.get("name")
+                prefix = None
+                if name and ":" in name:
+                    prefix, name = name.split(":", 1)
+                ns = t.nsmap.get(prefix, prefix)
+            else:
+                name = t.tag[t.tag.rfind("}") + 1:]
+                ns = t.nsmap[t.prefix]
+            self.metadata.setdefault(ns, {}).setdefault(name, []).append((t.text, dict(t.items())))
+
+    def _load_manifest(self, package):
+        manifest = package.find("{%s}manifest" % NAMESPACES["OPF"])
+        if manifest is None:
+            return
+
+        for r in manifest:
+            if r.tag != "{%s}item" % NAMESPACES["OPF"]:
+                continue
+
+            media_type = r.get("media-type")
+            properties = r.get("properties", "").split()
+            file_name = unquote(r.get("href"))
+
+            # people use wrong content types
+            if media_type == "image/jpg":
+                media_type = "image/jpeg"
+
+            if media_type == "application/xhtml+xml":
+                # The EPUB3 nav document counts as a document too, as in ebooklib
+                item_type = ebooklib.ITEM_DOCUMENT
+            elif media_type in IMAGE_MEDIA_TYPES:
+                item_type = ebooklib.ITEM_COVER if "cover-image" in properties else ebooklib.ITEM_IMAGE
+            elif media_type == "application/x-dtbncx+xml":
+                item_type = ebooklib.ITEM_NAVIGATION
+            elif media_type == "application/smil+xml":
+                item_type = ebooklib.ITEM_SMIL
+            else:
+                # Fall back to the file extension, like ebooklib's EpubItem
+                ext = posixpath.splitext(file_name)[1].lower()
+                item_type = next((uid for uid, exts in ebooklib.EXTENSIONS.items() if ext in exts),
+                                 ebooklib.ITEM_UNKNOWN)
+
+            item = EpubMember(self, r.get("id"), file_name, media_type, item_type)
+            self.items.append(item)
+            self._by_id.setdefault(item.id, item)
+            self._by_href.setdefault(file_name, item)
+
+    def get_metadata(self, namespace, name):
+        return self.metadata.get(NAMESPACES.get(namespace, namespace), {}).get(name, [])
+
+    def get_items(self):
+        return iter(self.items)
+
+    def get_items_of_type(self, item_type):
+        return (item for item in self.items if item.item_type == item_type)
+
+    def get_item_with_id(self, uid):
+        return self._by_id.get(uid)
+
+    def get_item_with_href(self, href):
+        return self._by_href.get(href)
+
+def open_epub(epub_path):
+    return LazyEpub(epub_path)
@@ -1,104 +1,109 @@
 import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import io
 import ebooklib
-from ebooklib import epub
+from ebooklib.utils import parse_html_string
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+# Imported as src.html_chunker from the package and as html_chunker when run as a script
+try:
+    from .epub_reader import open_epub
+    from .chunk_template import TEMPLATE_VERSION, render_html_chunk, dump_body_chunk
+    from .mime_chunk import MIME_VERSION, build_mime
+    from .profiling import stage, profile_to, profiling_enabled, memory_profiling_enabled
+except ImportError:
+    from epub_reader import open_epub
+    from chunk_template import TEMPLATE_VERSION, render_html_chunk, dump_body_chunk
+    from mime_chunk import MIME_VERSION, build_mime
+    from profiling import stage, profile_to, profiling_enabled, memory_profiling_enabled
+
+try:
+    from PIL import Image
+except ImportError: # Pillow is only needed for --max-image-width
+    Image = None
 
 import json
+import glob
+import gzip
+import hashlib
+import re
+import threading
 
-def create_html_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id, chapter_list=None, next_chunk_id=None):
-    """Wraps the raw paragraphs in a nice HTML email template."""
-    
-    # GCS Authenticated URL (requires Google login)
-    epub_url = f"https://storage.cloud.google.com/call-me-ishmael-graydon/books/{book_id}/ebook.epub"
-    
-    # Firebase Hosting URLs
-    index_url = f"https://call-me-ishmael.web.app/{book_id}/"
-    hosting_url = f"https://call-me-ishmael.web.app/{book_id}/chunk_{chunk_id:03d}"
-    
-    if next_chunk_id:
-        next_url = f"https://call-me-ishmael.web.app/{book_id}/chunk_{next_chunk_id:03d}"
-        footer_link = f'<a href="{next_url}">Jump to tomorrow\'s part</a>'
-    else:
-        footer_link = "<span>End of Book</span>"
-
-    # Format chapter info
-    chapter_info = ""
-    if chapter_list:
-        joined_chapters = ", ".join(chapter_list)
-        chapter_info = f", covering: {joined_chapters}"
-
-    html_template = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                margin: 0;
-                padding: 0;
-                background-color: #fdf6e3; 
-                font-family: Georgia, serif; 
-            }}
-            .container {{
-                max-width: 550px; 
-                margin: 0 auto; 
-                padding: 40px 20px;
-                background-color: #ffffff;
-                color: #333; 
-                line-height: 1.6; 
-                font-size: 18px;
-                border-radius: 8px; /* Optional: adds a slight card effect */
-                box-shadow: 0 2px 5px rgba(0,0,0,0.05); /* Optional: subtle shadow */
-            }}
-            /* Specific for dark mode readers if needed, but keeping it simple for now */
-            h1, h2, h3 {{ color: #2c3e50; margin-top: 0; }}
-            .footer {{ 
-                margin-top: 40px; 
-                font-size: 0.8em; 
-                color: #888; 
-                border-top: 1px solid #eee; 
-                padding-top: 20px; 
-                text-align: center;
-            }}
-            .footer p {{ margin: 5px 0; }}
-            .footer a {{
-                color: #888;
-                text-decoration: underline;
-            }}
-            .book-title a {{
-                color: #2c3e50;
-                text-decoration: none;
-            }}
-            .book-title a:hover {{
-                text-decoration: underline;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-             <h2 class="book-title"><a href="{index_url}">{book_title}</a> <span style="font-size:0.6em; color:#777; font-weight: normal;">(Part {chunk_id} of {total_chunks}{chapter_info})</span></h2>
-            
-            {"".join(content_blocks)}
-            
-            <div class="footer">
-                <p>End of Part {chunk_id}. Next part arrives tomorrow.</p>
-                <p><a href="{hosting_url}">Read this part online</a> | {footer_link}</p>
-            </div>
-        </div>
-    </body>
-    </html>
+BUILD_CACHE_PATH = "book_output/.build_cache.json"
+# Per-book archive of all chunks (see --pack); offsets are in manifest.json
+PACK_FILENAME = "chunks.pack"
+# Images and covers of every book, stored once under a name derived from their bytes.
+# Names never change meaning, so Firebase Hosting serves them as immutable.
+ASSETS_DIR = "book_output/assets"
+ASSETS_URL = "https://call-me-ishmael.web.app/assets"
+# Bumped when asset naming or placement changes, so cached books get re-chunked with the new URLs
+ASSET_LAYOUT = "sha256-v1"
+
+def _write_if_changed(path, data):
+    """Writes bytes to path unless the file already holds exactly those bytes."""
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+def asset_name(data, ext, variant=""):
+    """Content-addressed filename: the same bytes (and variant) get the same name in every book."""
+    digest = hashlib.sha256(data)
+    if variant:
+        # e.g. the downscaling width, which changes what ends up stored under the name
+        digest.update(f"\0{variant}".encode())
+    return f"{digest.hexdigest()[:24]}{ext.lower()}"
+
+def _write_asset(name, data):
+    """Stores an asset unless it exists already; written via rename so parallel books never see a partial file."""
+    path = f"{ASSETS_DIR}/{name}"
+    if os.path.exists(path):
+        return False
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    # Dot-prefixed so a leftover never gets deployed (firebase.json ignores **/.*)
+    tmp = f"{ASSETS_DIR}/.{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+def create_html_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id, chapter_list=None, next_chunk_id=None,
+                      body_only=False, mime=False):
     """
-    
+    Renders a chunk and saves it as book_output/<book_id>/chunk_XXX.html, or
+    with body_only as chunk_XXX.body.html (body + metadata, no page shell).
+    With mime, also saves the ready-to-send email body (text/plain + HTML
+    alternatives) as chunk_XXX.eml.
+    Returns the filename and the size of the fully rendered page in bytes.
+    """
+    html_template = render_html_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id,
+                                      chapter_list=chapter_list, next_chunk_id=next_chunk_id)
+    rendered_bytes = html_template.encode("utf-8")
+
     output_dir = f"book_output/{book_id}"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    filename = f"{output_dir}/chunk_{chunk_id:03d}.html"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html_template)
-    return filename
+    if body_only:
+        filename = f"{output_dir}/chunk_{chunk_id:03d}.body.html"
+        stored = dump_body_chunk(content_blocks, chunk_id, total_chunks, book_title, book_id,
+                                 chapter_list=chapter_list, next_chunk_id=next_chunk_id)
+        _write_if_changed(filename, stored.encode("utf-8"))
+    else:
+        filename = f"{output_dir}/chunk_{chunk_id:03d}.html"
+        _write_if_changed(filename, rendered_bytes)
 
-import re
+    if mime:
+        _write_if_changed(f"{output_dir}/chunk_{chunk_id:03d}.eml", build_mime(html_template))
+    return filename, len(rendered_bytes)
 
 def clean_title(text):
     """Normalize chapter titles."""
@@ -131,286 +136,833 @@ def clean_title(text):
         
     return text.strip()
 
-def process_epub(epub_path, book_id, target_words=2500):
-    book = epub.read_epub(epub_path)
-    # Try to get title, fall back to book_id if missing
-    try:
-        title = book.get_metadata('DC', 'title')[0][0]
-    except:
-        title = book_id.replace("_", " ").title()
-    
+# One top-level element of a document, measured once.
+# word_count is text only; image_count is weighted separately by the splitter.
+# heading_text is set for h1-h6 and for hgroups containing an h1/h2.
+Block = namedtuple("Block", ["html", "word_count", "image_count", "heading_text", "tag"])
+
+# Gmail clips messages over ~102 KB, hiding the footer links; stay safely below
+GMAIL_CLIP_BYTES = 100_000
+# Room left in the byte budget for the chapter list in the header
+LABEL_HEADROOM_BYTES = 1_000
+
+HEADER_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+WRAPPER_TAGS = ['div', 'section', 'article', 'main']
+WORDS_PER_IMAGE = 200
+
+def _resolve_href(doc_name, src):
+    """Resolve an <img src> relative to the document it appears in."""
+    # EPUB paths are always forward slashes
+    doc_dir = os.path.dirname(doc_name)
+
+    # Simple manual path resolution to avoid OS separator issues
+    if doc_dir:
+        absolute_href = f"{doc_dir}/{src}"
+    else:
+        absolute_href = src
+
+    # Handle ".." in path
+    parts = absolute_href.split('/')
+    resolved_parts = []
+    for part in parts:
+        if part == '..':
+            if resolved_parts:
+                resolved_parts.pop()
+        elif part != '.':
+            resolved_parts.append(part)
+    return "/".join(resolved_parts)
+
+class ImagePipeline:
+    """
+    Resolves and saves the images of one book into the shared asset store.
+    Each href is looked up once and named by its content (asset_name), so
+    identical images are stored once across all books and different images
+    never collide on a basename. Writes (plus optional downscaling) run on a
+    small thread pool. With save=False nothing is written, only URLs are
+    computed.
+    """
+
+    def __init__(self, book, book_id, save=False, max_width=None, workers=4):
+        if max_width and Image is None:
+            raise RuntimeError("Downscaling images requires Pillow (uv sync --extra images)")
+        self.book = book
+        self.book_id = book_id
+        self.save = save
+        self.max_width = max_width
+        self._urls = {}      # resolved href -> hosted URL, or None if missing
+        self._queued = set() # asset names already being saved by this book
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=workers) if save else None
+
+    def hosted_src(self, doc_name, src):
+        """Returns the hosted URL for an <img src> found in doc_name, or None."""
+        return self.url_for_href(_resolve_href(doc_name, src))
+
+    def url_for_href(self, resolved_href):
+        if resolved_href not in self._urls:
+            self._urls[resolved_href] = self._add(resolved_href)
+        return self._urls[resolved_href]
+
+    def _add(self, resolved_href):
+        # Find the image item in the book
+        img_item = self.book.get_item_with_href(resolved_href)
+        if not img_item:
+            print(f"Warning: Could not find image {resolved_href}")
+            return None
+
+        # Named by content; downscaled copies get their own name per width
+        data = img_item.get_content()
+        ext = os.path.splitext(resolved_href)[1].lower()
+        variant = f"w{self.max_width}" if self.max_width and ext in (".jpg", ".jpeg", ".png") else ""
+        img_filename = asset_name(data, ext, variant)
+        if self.save and img_filename not in self._queued:
+            self._queued.add(img_filename)
+            self._pending.append(self._executor.submit(self._save, img_filename, data))
+
+        # We use absolute URL so it works in Emails AND on the website (regardless of current path/route)
+        return f"{ASSETS_URL}/{img_filename}"
+
+    def _save(self, img_filename, data):
+        if os.path.exists(f"{ASSETS_DIR}/{img_filename}"):
+            # Stored by an earlier build or another book; same name, same bytes
+            return
+        if self.max_width:
+            data = self._downscale(img_filename, data)
+        _write_asset(img_filename, data)
+
+    def _downscale(self, img_filename, data):
+        """Shrinks JPEG/PNG images wider than max_width; other formats pass through."""
+        ext = os.path.splitext(img_filename)[1].lower()
+        if ext not in (".jpg", ".jpeg", ".png"):
+            return data
+
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width <= self.max_width:
+                return data
+            height = max(1, round(img.height * self.max_width / img.width))
+            resized = img.resize((self.max_width, height), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if ext == ".png":
+            resized.save(out, "PNG", optimize=True)
+        else:
+            resized.convert("RGB").save(out, "JPEG", quality=85, optimize=True, progressive=True)
+        return out.getvalue() if out.tell() < len(data) else data
+
+    def close(self):
+        """Waits for queued writes and re-raises the first failure."""
+        if not self._executor:
+            return
+        try:
+            for future in self._pending:
+                future.result()
+        finally:
+            self._executor.shutdown()
+            self._pending = []
+
+IMAGE_STYLE = "max-width: 100%; height: auto; display: block; margin: 20px auto;"
+
+def _soup_blocks(item, images):
+    """Reference engine: BeautifulSoup with the pure-Python html.parser."""
+    with stage("parse"):
+        soup = BeautifulSoup(item.get_body_content(), 'html.parser')
+
+    # --- HANDLE IMAGES ---
+    # Find all images in this document and point them at our hosted images folder
+    with stage("images"):
+        for img_tag in soup.find_all('img'):
+            src = img_tag.get('src')
+            if not src:
+                continue
+            hosted_src = images.hosted_src(item.get_name(), src)
+            if hosted_src:
+                img_tag['src'] = hosted_src
+                img_tag['style'] = IMAGE_STYLE
+
+    # get_body_content() strips a bare <body> (one without attributes), leaving just its children
+    root = soup.body if soup.body is not None else soup
+
+    # Get all top-level tags to iterate from the modified soup
+    tags = root.find_all(recursive=False)
+
+    # Flatten wrapper tags (section, div, article) to expose content
+    # accurately, allowing us to split large chapters and find headers nested in sections
+    while len(tags) == 1 and tags[0].name in WRAPPER_TAGS:
+        tags = tags[0].find_all(recursive=False)
+
+    blocks = []
+    with stage("measure"):
+        for tag in tags:
+            heading_text = None
+            if tag.name in HEADER_TAGS:
+                heading_text = tag.get_text().strip()
+            elif tag.name == 'hgroup':
+                # Find first h1/h2 in group (common in standardebooks)
+                header = tag.find(['h1', 'h2'])
+                if header:
+                    heading_text = header.get_text().strip()
+
+            blocks.append(Block(
+                html=str(tag),
+                word_count=len(tag.get_text().split()),
+                image_count=len(tag.find_all('img')),
+                heading_text=heading_text,
+                tag=tag.name,
+            ))
+    return blocks
+
+def _lxml_blocks(item, images):
+    """
+    Fast engine: parses the raw XHTML once with libxml2 (the same parser
+    ebooklib uses internally) and measures each top-level element in place.
+    """
+    with stage("parse"):
+        try:
+            tree = parse_html_string(item.get_content())
+        except Exception:
+            return []
+    body = tree.find('body')
+    if body is None:
+        return []
+
+    with stage("images"):
+        for img_el in body.iter('img'):
+            src = img_el.get('src')
+            if not src:
+                continue
+            hosted_src = images.hosted_src(item.get_name(), src)
+            if hosted_src:
+                img_el.set('src', hosted_src)
+                img_el.set('style', IMAGE_STYLE)
+
+    # Elements only: comments and processing instructions have a non-str tag
+    tags = [el for el in body if isinstance(el.tag, str)]
+    while len(tags) == 1 and tags[0].tag in WRAPPER_TAGS:
+        tags = [el for el in tags[0] if isinstance(el.tag, str)]
+
+    blocks = []
+    with stage("measure"):
+        for el in tags:
+            heading_text = None
+            if el.tag in HEADER_TAGS:
+                heading_text = el.text_content().strip()
+            elif el.tag == 'hgroup':
+                header = next(el.iter('h1', 'h2'), None)
+                if header is not None:
+                    heading_text = header.text_content().strip()
+
+            blocks.append(Block(
+                html=lxml_html.tostring(el, encoding='unicode', with_tail=False),
+                word_count=len(el.text_content().split()),
+                # Descendants only, matching tag.find_all('img') in the soup engine
+                image_count=sum(1 for _ in el.iterdescendants('img')),
+                heading_text=heading_text,
+                tag=el.tag,
+            ))
+    return blocks
+
+ENGINES = {"soup": _soup_blocks, "lxml": _lxml_blocks}
+
+def _chunk_labels(current_chapters, last_chapter_title):
+    # Determine label: if no new chapters, use continued
+    chunk_labels = list(current_chapters)
+    if not chunk_labels:
+        chunk_labels = [f"{last_chapter_title} (cont.)"]
+    return chunk_labels
+
+def split_documents(documents, target_words=2500, max_body_bytes=None):
+    """
+    Greedily groups the blocks of each document into chunks of roughly
+    target_words. Yields {'blocks': [Block, ...], 'chapters': [...]} dicts
+    as each chunk closes.
+
+    If max_body_bytes is set, a chunk is also closed before its blocks'
+    UTF-8 size (plus its "covering: ..." chapter labels) would exceed it,
+    regardless of the word-count relaxations.
+    """
     current_blocks = []
     current_word_count = 0
-    all_chunks_data = [] # Store chunks temporarily
-    
+    current_bytes = 0
+
     # Track chapters found in the current buffer
     current_chapters = []
+    label_bytes = 0 # Size of current_chapters once joined into the page header
     last_chapter_title = "Start" # Default for beginning
-    
-    # 1. Extract Cover Image
+
+    for blocks in documents:
+        if not blocks:
+            continue
+
+        with stage("split"):
+            # Add weight for images to avoid huge emails with many images
+            chapter_word_counts = [b.word_count + b.image_count * WORDS_PER_IMAGE for b in blocks]
+            total_chapter_words = sum(chapter_word_counts)
+            words_processed_in_chapter = 0
+
+            for block, text_len in zip(blocks, chapter_word_counts):
+                # --- EXTRACT CHAPTER TITLES ---
+                # If tag is H1 or H2 (or an hgroup holding one), treat as chapter title
+                new_chapter = None
+                previous_chapter_title = last_chapter_title
+                if block.tag in ['h1', 'h2', 'hgroup'] and block.heading_text:
+                    if len(block.heading_text) < 100: # Sanity check length
+                        cleaned_text = clean_title(block.heading_text)
+                        last_chapter_title = cleaned_text
+                        if cleaned_text not in current_chapters:
+                            current_chapters.append(cleaned_text)
+                            label_bytes += len(cleaned_text.encode("utf-8")) + 2
+                            new_chapter = cleaned_text
+
+                # Check remaining words in this chapter (including current tag)
+                remaining_in_chapter = total_chapter_words - words_processed_in_chapter
+
+                block_bytes = len(block.html.encode("utf-8")) if max_body_bytes else 0
+                # Never close a chunk holding only headings: the block joins them even over budget
+                over_bytes = bool(max_body_bytes and current_blocks
+                                  and current_bytes + block_bytes + label_bytes > max_body_bytes
+                                  and any(b.tag not in HEADER_TAGS for b in current_blocks))
+
+                # Check if adding this would exceed limit
+                if over_bytes or (current_word_count + text_len > target_words and current_word_count > 500):
+
+                    # RULE 1: Relax limit if we can finish the chapter soon (never past the byte budget)
+                    if remaining_in_chapter < 750 and not over_bytes:
+                        pass # Don't split
+                    else:
+                        # RULE 2: Avoid ending on a header
+                        if len(current_blocks) > 1 and current_blocks[-1].tag in HEADER_TAGS:
+                            header_to_move = current_blocks.pop()
+
+                            # Save current chunk
+                            yield {
+                                'blocks': current_blocks,
+                                'chapters': _chunk_labels(current_chapters, last_chapter_title)
+                            }
+
+                            current_blocks = [header_to_move]
+                            current_word_count = header_to_move.word_count
+                            current_bytes = len(header_to_move.html.encode("utf-8")) if max_body_bytes else 0
+
+                            # Reset: The moved header is now the "current" chapter for the next chunk
+                            header_text = clean_title(header_to_move.heading_text)
+                            current_chapters = [header_text] if header_text else []
+                            label_bytes = len(header_text.encode("utf-8")) + 2 if header_text else 0
+                            if header_text:
+                                last_chapter_title = header_text
+                        else:
+                            # A heading that opens the next chunk labels that chunk, not this one
+                            closed_chapters = [c for c in current_chapters if c != new_chapter]
+                            yield {
+                                'blocks': current_blocks,
+                                'chapters': _chunk_labels(closed_chapters, previous_chapter_title)
+                            }
+                            current_blocks = []
+                            current_word_count = 0
+                            current_bytes = 0
+                            current_chapters = [new_chapter] if new_chapter else []
+                            label_bytes = len(new_chapter.encode("utf-8")) + 2 if new_chapter else 0
+
+                current_blocks.append(block)
+                current_word_count += text_len
+                current_bytes += block_bytes
+                words_processed_in_chapter += text_len
+
+    # Capture final chunk
+    if current_blocks:
+        yield {
+            'blocks': current_blocks,
+            'chapters': _chunk_labels(current_chapters, last_chapter_title)
+        }
+
+def _book_title(book, book_id):
+    # Try to get title, fall back to book_id if missing
+    try:
+        return book.get_metadata('DC', 'title')[0][0]
+    except:
+        return book_id.replace("_", " ").title()
+
+def _extract_cover(book, book_id):
     cover_item = None
-    
+
     # Try getting cover by ID from metadata
     try:
         cover_id = book.get_metadata('OPF', 'cover')[0][0]
         cover_item = book.get_item_with_id(cover_id)
     except:
         pass
-        
+
     # If not found, look for items marked as cover
     if not cover_item:
         covers = list(book.get_items_of_type(ebooklib.ITEM_COVER))
         if covers:
             cover_item = covers[0]
-            
+
     # If still not found, search images for "cover" in name
     if not cover_item:
         for img in book.get_items_of_type(ebooklib.ITEM_IMAGE):
             if 'cover' in img.get_name().lower() or 'cover' in img.get_id().lower():
                 cover_item = img
                 break
-    
+
     # Save the cover if found
     if cover_item:
         file_name = cover_item.get_name()
         ext = os.path.splitext(file_name)[1]
-        
+
         # If extraction failed or weird name, default to .jpg
         if not ext or len(ext) > 5:
             ext = ".jpg"
-            
-        cover_path = f"book_output/{book_id}/cover{ext}"
+
+        # The cover goes to the asset store; cover.json tells generate_index.py where
         output_dir = f"book_output/{book_id}"
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-            
-        with open(cover_path, "wb") as f:
-            f.write(cover_item.get_content())
-        print(f"Saved cover image to {cover_path}")
+        data = cover_item.get_content()
+        name = asset_name(data, ext)
+        _write_asset(name, data)
+        _write_if_changed(f"{output_dir}/cover.json", json.dumps({"src": f"/assets/{name}"}).encode("utf-8"))
+        # Per-book copies from before the asset store
+        for old_cover in glob.glob(f"{output_dir}/cover.*"):
+            if not old_cover.endswith("cover.json"):
+                os.remove(old_cover)
+        print(f"Saved cover image to {ASSETS_DIR}/{name}")
     else:
         print("No cover image found.")
 
-    # Create images directory
-    images_output_dir = f"book_output/{book_id}/images"
-    if not os.path.exists(images_output_dir):
-        os.makedirs(images_output_dir)
-
-    # 2. Iterate over every document in the book (Chapters, Intro, etc.)
+def _iter_documents(book, engine, images):
+    block_source = ENGINES[engine]
     for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-        soup = BeautifulSoup(item.get_body_content(), 'html.parser')
-        
-        # --- HANDLE IMAGES ---
-        # Find all images in this document and process them
-        for img_tag in soup.find_all('img'):
-            src = img_tag.get('src')
-            if not src:
-                continue
-                
-            # Resolve absolute path within EPUB based on current document path
-            # EPUB paths are always forward slashes
-            doc_dir = os.path.dirname(item.get_name())
-            
-            # Simple manual path resolution to avoid OS separator issues
-            if doc_dir:
-                absolute_href = f"{doc_dir}/{src}"
-            else:
-                absolute_href = src
-                
-            # Handle ".." in path
-            parts = absolute_href.split('/')
-            resolved_parts = []
-            for part in parts:
-                if part == '..':
-                    if resolved_parts:
-                        resolved_parts.pop()
-                elif part != '.':
-                    resolved_parts.append(part)
-            resolved_href = "/".join(resolved_parts)
-
-            # Find the image item in the book
-            img_item = book.get_item_with_href(resolved_href)
-            
-            if img_item:
-                # Use the basename for the saved file
-                img_filename = os.path.basename(resolved_href)
-                save_path = f"{images_output_dir}/{img_filename}"
-                
-                # Save image if not already saved
-                if not os.path.exists(save_path):
-                    with open(save_path, "wb") as f:
-                        f.write(img_item.get_content())
-                
-                # Update the source to point to our hosted images folder
-                # We use absolute URL so it works in Emails AND on the website (regardless of current path/route)
-                img_tag['src'] = f"https://call-me-ishmael.web.app/{book_id}/images/{img_filename}"
-                img_tag['style'] = "max-width: 100%; height: auto; display: block; margin: 20px auto;"
-            else:
-                 print(f"Warning: Could not find image {resolved_href}")
+        yield block_source(item, images)
 
-        # Get all top-level tags to iterate from the modified soup
-        tags = soup.body.find_all(recursive=False)
-        
-        # Flatten wrapper tags (section, div, article) to expose content
-        # accurately, allowing us to split large chapters and find headers nested in sections
-        while len(tags) == 1 and tags[0].name in ['div', 'section', 'article', 'main']:
-            tags = tags[0].find_all(recursive=False)
-            
-        if not tags:
-            continue
-            
-        # Efficiently calculate remaining words for this chapter
-        # Note: Images now have text length 0, so we might want to add phantom words
-        chapter_word_counts = [] 
-        for tag in tags:
-             text_count = len(tag.get_text().split())
-             # Add weight for images to avoid huge emails with many images
-             img_count = len(tag.find_all('img'))
-             text_count += (img_count * 200) # 200 words equivalent per image
-             chapter_word_counts.append(text_count)
-             
-        total_chapter_words = sum(chapter_word_counts)
-        words_processed_in_chapter = 0
-        
-        for i, tag in enumerate(tags):
-            tag_html = str(tag)
-            text_len = chapter_word_counts[i]
-            
-            # --- EXTRACT CHAPTER TITLES ---
-            # If tag is H1 or H2, treat as chapter title
-            # Also handle hgroup (common in standardebooks)
-            
-            title_text = None
-            if tag.name in ['h1', 'h2']:
-                title_text = tag.get_text().strip()
-            elif tag.name == 'hgroup':
-                 # Find first h1/h2 in group
-                 header = tag.find(['h1', 'h2'])
-                 if header:
-                     title_text = header.get_text().strip()
-
-            if title_text:
-                if len(title_text) < 100: # Sanity check length
-                    cleaned_text = clean_title(title_text)
-                    last_chapter_title = cleaned_text
-                    if cleaned_text not in current_chapters:
-                        current_chapters.append(cleaned_text)
-
-            # Check remaining words in this chapter (including current tag)
-            remaining_in_chapter = total_chapter_words - words_processed_in_chapter
-            
-            # Check if adding this would exceed limit
-            if current_word_count + text_len > target_words and current_word_count > 500:
-                
-                # RULE 1: Relax limit if we can finish the chapter soon
-                if remaining_in_chapter < 750:
-                    pass # Don't split
-                else:
-                    # RULE 2: Avoid ending on a header
-                    last_block_is_header = False
-                    if current_blocks:
-                        last_html = current_blocks[-1].strip()
-                        if any(last_html.startswith(f"<{h}") for h in ['h1','h2','h3','h4','h5','h6']):
-                            last_block_is_header = True
-                    
-                    if last_block_is_header:
-                        header_to_move = current_blocks.pop()
- 
-                        # Save current chunk
-                        # Determine label: if no new chapters, use continued
-                        chunk_labels = list(current_chapters)
-                        if not chunk_labels:
-                            chunk_labels = [f"{last_chapter_title} (cont.)"]
-
-                        all_chunks_data.append({
-                            'blocks': current_blocks,
-                            'chapters': chunk_labels
-                        })
-                        
-                        current_blocks = [header_to_move]
-                        header_soup = BeautifulSoup(header_to_move, 'html.parser')
-                        current_word_count = len(header_soup.get_text().split())
-                        
-                        # Reset: The moved header is now the "current" chapter for the next chunk
-                        header_text = clean_title(header_soup.get_text().strip())
-                        current_chapters = [header_text] if header_text else []
-                        if header_text:
-                            last_chapter_title = header_text
-                    else:
-                        # Determine label
-                        chunk_labels = list(current_chapters)
-                        if not chunk_labels:
-                            chunk_labels = [f"{last_chapter_title} (cont.)"]
-
-                        all_chunks_data.append({
-                            'blocks': current_blocks,
-                            'chapters': chunk_labels
-                        })
-                        current_blocks = []
-                        current_word_count = 0
-                        current_chapters = []
-            
-            current_blocks.append(tag_html)
-            current_word_count += text_len
-            words_processed_in_chapter += text_len
-
-    # 3. Capture final chunk
-    if current_blocks:
-        chunk_labels = list(current_chapters)
-        if not chunk_labels:
-             chunk_labels = [f"{last_chapter_title} (cont.)"]
-             
-        all_chunks_data.append({
-            'blocks': current_blocks,
-            'chapters': chunk_labels
-        })
-        
-    # 4. Generate Files & Manifest
+# --- Intra-book parallel parsing ---
+# Worker processes parse and measure documents; the parent keeps the
+# order-dependent parts (image dedup/saving and the greedy splitter).
+
+IMAGE_TOKEN = "__ishmael_img_{}__"
+IMAGE_TOKEN_RE = re.compile(r"__ishmael_img_(\d+)__")
+
+class _DeferredImages:
+    """
+    Stand-in for ImagePipeline inside a worker: checks the image exists and
+    hands back a placeholder token; the parent swaps in the real URL.
+    """
+
+    def __init__(self, book):
+        self.book = book
+        self.refs = []
+
+    def hosted_src(self, doc_name, src):
+        resolved_href = _resolve_href(doc_name, src)
+        if not self.book.get_item_with_href(resolved_href):
+            print(f"Warning: Could not find image {resolved_href}")
+            return None
+        self.refs.append(resolved_href)
+        return IMAGE_TOKEN.format(len(self.refs) - 1)
+
+_worker_book = None
+
+def _init_document_worker(epub_path):
+    global _worker_book
+    _worker_book = open_epub(epub_path)
+
+def _measure_document(doc_name, engine):
+    images = _DeferredImages(_worker_book)
+    blocks = ENGINES[engine](_worker_book.get_item_with_href(doc_name), images)
+    return blocks, images.refs
+
+def _iter_documents_parallel(book, epub_path, engine, images, doc_jobs):
+    """Like _iter_documents, but documents are parsed in doc_jobs processes."""
+    doc_names = [item.get_name() for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT)]
+    with ProcessPoolExecutor(max_workers=doc_jobs, initializer=_init_document_worker,
+                             initargs=(epub_path,)) as executor:
+        # map() yields in submission order, so the splitter sees spine order
+        for blocks, refs in executor.map(_measure_document, doc_names, [engine] * len(doc_names),
+                                         chunksize=4):
+            if refs:
+                # Resolve in document order so dedup picks the same names as a serial run
+                urls = [images.url_for_href(href).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+                        for href in refs]
+                blocks = [b._replace(html=IMAGE_TOKEN_RE.sub(lambda m: urls[int(m.group(1))], b.html))
+                          for b in blocks]
+            yield blocks
+
+def _spool_dir(book_id):
+    return f"book_output/{book_id}/.spool"
+
+def _spool_chunks(chunks, book_id):
+    """
+    Writes each chunk's body to disk as soon as it closes and keeps only its
+    chapter labels, so memory stays bounded by one chunk instead of the book.
+    The header/footer (which need total_chunks) are applied afterwards.
+    """
+    spool_dir = _spool_dir(book_id)
+    if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir)
+
+    spooled = []
+    for data in chunks:
+        spool_path = f"{spool_dir}/chunk_{len(spooled) + 1:03d}.part"
+        with stage("write"), open(spool_path, "w", encoding="utf-8") as f:
+            for block in data['blocks']:
+                f.write(block.html)
+        spooled.append({'spool_path': spool_path, 'chapters': data['chapters']})
+    return spooled
+
+def process_epub(epub_path, book_id, target_words=2500, engine="soup", stream=False, max_image_width=None,
+                 doc_jobs=1, max_bytes=GMAIL_CLIP_BYTES, body_only=False, mime=False, pack=False, profile=False):
+    # With --profile / ISHMAEL_PROFILE=1, per-stage timings go to profile.json next to manifest.json;
+    # profile="memory" (--profile-memory / ISHMAEL_PROFILE=memory) adds tracemalloc peaks, at a large cost
+    if profiling_enabled(profile):
+        profiler = profile_to(f"book_output/{book_id}/profile.json",
+                              extra={"book_id": book_id, "engine": engine, "doc_jobs": doc_jobs, "stream": stream},
+                              trace_memory=memory_profiling_enabled(profile))
+    else:
+        profiler = nullcontext()
+
+    with profiler:
+        # Only the OPF package is parsed here; member bytes are read on demand
+        with stage("epub_load"):
+            book = open_epub(epub_path)
+        with book:
+            return _chunk_book(book, book_id, target_words, engine, stream, max_image_width, doc_jobs, max_bytes,
+                               body_only, mime, pack)
+
+def _body_budget(title, book_id, max_bytes):
+    """Bytes left for chunk content once the page shell is accounted for."""
+    if not max_bytes:
+        return None
+    shell = render_html_chunk([], 9999, 9999, title, book_id, next_chunk_id=9999)
+    return max(1, max_bytes - len(shell.encode("utf-8")) - LABEL_HEADROOM_BYTES)
+
+def _chunk_book(book, book_id, target_words, engine, stream, max_image_width, doc_jobs, max_bytes, body_only, mime,
+                pack=False):
+    title = _book_title(book, book_id)
+
+    # 1. Extract Cover Image
+    with stage("cover"):
+        _extract_cover(book, book_id)
+
+    # Images now live in the shared asset store. A per-book images/ folder from older builds is
+    # left alone: emails already delivered link to https://<site>/<book_id>/images/<name>
+
+    # 2. Iterate over every document in the book (Chapters, Intro, etc.) and split
+    images = ImagePipeline(book, book_id, save=True, max_width=max_image_width)
+    try:
+        if doc_jobs > 1:
+            documents = _iter_documents_parallel(book, book.epub_path, engine, images, doc_jobs)
+        else:
+            documents = _iter_documents(book, engine, images)
+        chunks = split_documents(documents, target_words, _body_budget(title, book_id, max_bytes))
+        if stream:
+            all_chunks_data = _spool_chunks(chunks, book_id)
+        else:
+            all_chunks_data = list(chunks) # Store chunks temporarily
+    finally:
+        with stage("image_write"):
+            images.close()
+
+    # 3. Generate Files & Manifest
     total_chunks = len(all_chunks_data)
+    if not total_chunks:
+        # Uploaded as is, the book would count as finished and be deactivated on its first day
+        raise ValueError(f"No chunks produced for '{title}' (no body content found)")
     manifest = []
-    
+    # With pack: every chunk as the Cloud Function sends it, each its own gzip member, back to back
+    pack_members = []
+    pack_offset = 0
+
     for i, data in enumerate(all_chunks_data):
         chunk_num = i + 1
-        blocks = data['blocks']
         chapters = data['chapters']
-        
         # Determine next chunk ID for link
         next_chunk_id = (chunk_num + 1) if chunk_num < total_chunks else None
-        
-        create_html_chunk(blocks, chunk_num, total_chunks, title, book_id, 
-                          chapter_list=chapters, next_chunk_id=next_chunk_id)
-        
+
+        with stage("write"):
+            if stream:
+                with open(data['spool_path'], "r", encoding="utf-8") as f:
+                    blocks = [f.read()]
+                os.remove(data['spool_path'])
+            else:
+                blocks = [b.html for b in data['blocks']]
+
+            filename, size = create_html_chunk(blocks, chunk_num, total_chunks, title, book_id,
+                                               chapter_list=chapters, next_chunk_id=next_chunk_id,
+                                               body_only=body_only, mime=mime)
+        if max_bytes and size > max_bytes:
+            print(f"Warning: chunk {chunk_num} is {size} bytes, over the {max_bytes} byte budget")
+
         manifest.append({
             "chunk_id": chunk_num,
-            "chapters": chapters
+            "chapters": chapters,
+            "bytes": size
         })
 
+        if pack:
+            sent_path = f"book_output/{book_id}/chunk_{chunk_num:03d}.eml" if mime else filename
+            with open(sent_path, "rb") as f:
+                member = gzip.compress(f.read(), compresslevel=9, mtime=0)
+            pack_members.append(member)
+            manifest[-1]["pack_offset"] = pack_offset
+            manifest[-1]["pack_length"] = len(member)
+            pack_offset += len(member)
+
+    if stream:
+        os.rmdir(_spool_dir(book_id))
+
+    # Remove chunks left over from a previous, longer build of this book,
+    # or stored in the other format (full page vs body-only)
+    for stale in glob.glob(f"book_output/{book_id}/chunk_*.html"):
+        match = re.fullmatch(r"chunk_(\d+)(\.body)?\.html", os.path.basename(stale))
+        if match and (int(match.group(1)) > total_chunks or bool(match.group(2)) != body_only):
+            os.remove(stale)
+    for stale in glob.glob(f"book_output/{book_id}/chunk_*.eml"):
+        match = re.fullmatch(r"chunk_(\d+)\.eml", os.path.basename(stale))
+        if match and (int(match.group(1)) > total_chunks or not mime):
+            os.remove(stale)
+
+    pack_path = f"book_output/{book_id}/{PACK_FILENAME}"
+    if pack:
+        with stage("write"):
+            _write_if_changed(pack_path, b"".join(pack_members))
+    elif os.path.exists(pack_path):
+        os.remove(pack_path)
+
     # Save Manifest
     manifest_path = f"book_output/{book_id}/manifest.json"
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, indent=2)
-        
+    with stage("write"):
+        _write_if_changed(manifest_path, json.dumps(manifest, indent=2).encode("utf-8"))
+
     print(f"Created {total_chunks} chunks & manifest for '{title}'")
+    return total_chunks
+
+def check_parity(epub_path, book_id, target_words=2500, engines=("soup", "lxml")):
+    """
+    Splits a book with two engines without writing any output and lists the
+    differences: chunk boundaries, chapter labels and per-chunk text. Markup
+    may legitimately differ in whitespace and void-tag spelling.
+    """
+    runs = {}
+    with open_epub(epub_path) as book:
+        for engine in engines:
+            documents = _iter_documents(book, engine, ImagePipeline(book, book_id))
+            runs[engine] = list(split_documents(documents, target_words))
+
+    base_engine, other_engine = engines
+    base, other = runs[base_engine], runs[other_engine]
+    problems = []
+    if len(base) != len(other):
+        problems.append(f"chunk count {len(base)} ({base_engine}) != {len(other)} ({other_engine})")
+    for chunk_num, (a, b) in enumerate(zip(base, other), start=1):
+        if a['chapters'] != b['chapters']:
+            problems.append(f"chunk {chunk_num}: chapters {a['chapters']} != {b['chapters']}")
+        a_words = sum(blk.word_count for blk in a['blocks'])
+        b_words = sum(blk.word_count for blk in b['blocks'])
+        if len(a['blocks']) != len(b['blocks']) or a_words != b_words:
+            problems.append(f"chunk {chunk_num}: {len(a['blocks'])} blocks/{a_words} words "
+                            f"!= {len(b['blocks'])} blocks/{b_words} words")
+    return problems
+
+def load_build_cache():
+    if not os.path.exists(BUILD_CACHE_PATH):
+        return {}
+    with open(BUILD_CACHE_PATH, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+def save_build_cache(cache):
+    _write_if_changed(BUILD_CACHE_PATH, json.dumps(cache, indent=2, sort_keys=True).encode("utf-8"))
+
+# process_epub options that change what is written, with process_epub's defaults. Options that only
+# change how a book is built (stream, doc_jobs, profile) stay out of the key; a new output option
+# must be added here or cached books won't be rebuilt when it changes
+CACHE_KEY_OPTIONS = {"target_words": 2500, "engine": "soup", "max_image_width": None,
+                     "max_bytes": GMAIL_CLIP_BYTES, "body_only": False, "mime": False, "pack": False}
+
+def _epub_cache_key(epub_path, options):
+    sha = hashlib.sha256()
+    with open(epub_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    # Body-only chunks get the page shell at render time, so template changes don't invalidate
+    # them; unless .eml files are built too, which bake the shell in
+    template_version = None if options.get("body_only") and not options.get("mime") else TEMPLATE_VERSION
+    key = {"sha256": sha.hexdigest(), "template_version": template_version, "asset_layout": ASSET_LAYOUT,
+           "mime_version": MIME_VERSION if options.get("mime") else None}
+
+    # Fill in the defaults so omitted and explicit options share a key
+    for name, default in CACHE_KEY_OPTIONS.items():
+        key[name] = options.get(name, default)
+    return key
+
+# Shared assets referenced from chunk pages (absolute URLs) and cover.json ("/assets/...")
+ASSET_REF_RE = re.compile(r"/assets/([0-9a-f]{24}\.[A-Za-z0-9]+)")
+
+def _book_outputs(book_id):
+    """
+    Every file a finished build of book_id relies on: its manifest, chunks,
+    pack and cover.json, plus the shared assets those pages reference.
+    """
+    book_dir = f"book_output/{book_id}"
+    outputs, assets = [], set()
+    for name in sorted(os.listdir(book_dir)):
+        if not (name.startswith("chunk_") or name in ("manifest.json", "cover.json", PACK_FILENAME)):
+            continue
+        outputs.append(f"{book_dir}/{name}")
+        if name.endswith((".html", "cover.json")):
+            with open(f"{book_dir}/{name}", "r", encoding="utf-8") as f:
+                assets.update(ASSET_REF_RE.findall(f.read()))
+    return outputs + [f"{ASSETS_DIR}/{asset}" for asset in sorted(assets)]
+
+def _process_book(epub_path, book_id, cached=None, **options):
+    """
+    Worker entry point: chunk one book and report how it went.
+    Books whose cache key matches `cached`, and whose recorded outputs
+    (chunks, pack, manifest and the shared assets they use) are all still
+    on disk, are skipped without opening the EPUB; unless profiling, which
+    needs a build to measure. `options` are passed straight to process_epub.
+    """
+    start = time.perf_counter()
+    result = {"book_id": book_id, "chunks": 0, "skipped": False, "cache": None, "error": None}
+    try:
+        key = _epub_cache_key(epub_path, options)
+        if (cached and not profiling_enabled(options.get("profile"))
+                and {k: cached.get(k) for k in key} == key and cached.get("outputs")
+                and all(os.path.exists(path) for path in cached["outputs"])):
+            result["chunks"] = cached.get("chunks", 0)
+            result["skipped"] = True
+            result["cache"] = cached
+        else:
+            result["chunks"] = process_epub(epub_path, book_id, **options)
+            result["cache"] = dict(key, chunks=result["chunks"], outputs=_book_outputs(book_id))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def process_library(books_dir="books", jobs=1, force=False, **options):
+    """
+    Chunks every EPUB in books_dir. With jobs > 1 books are processed in
+    parallel worker processes; each book writes only to its own
+    book_output/<book_id>/ folder, so the output matches the serial run.
+
+    Books are skipped when their content hash, TEMPLATE_VERSION and the
+    output-affecting process_epub options match the build cache and the
+    files of their last build are all still there, unless force is set.
+    """
+    epub_files = sorted(f for f in os.listdir(books_dir) if f.endswith(".epub"))
+    if not epub_files:
+        print(f"No .epub files found in {books_dir}/")
+        return []
+
+    # Create a book_id from filename (e.g., "moby_dick.epub" -> "moby_dick")
+    books = [(os.path.join(books_dir, f), os.path.splitext(f)[0]) for f in epub_files]
+
+    cache = {} if force else load_build_cache()
+
+    results = []
+    if jobs <= 1:
+        for epub_path, book_id in books:
+            print(f"--- Processing {book_id} ---")
+            results.append(_process_book(epub_path, book_id, cache.get(book_id), **options))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+            for epub_path, book_id in books:
+                print(f"--- Queued {book_id} ---")
+                future = executor.submit(_process_book, epub_path, book_id, cache.get(book_id), **options)
+                futures[future] = book_id
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # The worker process itself died (e.g. killed for memory)
+                    results.append({"book_id": futures[future], "chunks": 0, "skipped": False,
+                                    "cache": None, "seconds": 0.0, "error": f"{type(e).__name__}: {e}"})
+        results.sort(key=lambda r: r["book_id"])
+
+    # Only the parent process touches the cache file, so workers never race on it
+    for r in results:
+        if r["cache"]:
+            cache[r["book_id"]] = r["cache"]
+        else:
+            cache.pop(r["book_id"], None)
+    save_build_cache(cache)
+
+    print("--- Summary ---")
+    for r in results:
+        if r["error"]:
+            print(f"[{r['book_id']}] FAILED after {r['seconds']:.2f}s: {r['error']}")
+        elif r["skipped"]:
+            print(f"[{r['book_id']}] unchanged, skipped ({r['chunks']} chunks cached)")
+        else:
+            print(f"[{r['book_id']}] {r['chunks']} chunks in {r['seconds']:.2f}s")
+    return results
 
 # --- USAGE ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split EPUBs in books/ into daily HTML chunks.")
+    parser.add_argument("--books-dir", default="books", help="Directory containing .epub files")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of books to chunk in parallel worker processes (default: 1)")
+    parser.add_argument("--target-words", type=int, default=2500, help="Approximate words per chunk")
+    parser.add_argument("--force", action="store_true", help="Ignore the build cache and re-chunk every book")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="soup",
+                        help="Splitting engine: 'soup' (reference BeautifulSoup) or 'lxml' (faster single pass)")
+    parser.add_argument("--doc-jobs", type=int, default=1,
+                        help="Parse the documents of each book in this many worker processes (default: 1)")
+    parser.add_argument("--max-bytes", type=int, default=GMAIL_CLIP_BYTES,
+                        help=f"Close a chunk before its rendered HTML exceeds this many bytes, 0 to disable "
+                             f"(default: {GMAIL_CLIP_BYTES}, under Gmail's ~102 KB clipping limit)")
+    parser.add_argument("--body-only", action="store_true",
+                        help="Store chunk bodies plus metadata (chunk_XXX.body.html); the page shell is applied at "
+                             "send/publish time")
+    parser.add_argument("--mime", action="store_true",
+                        help="Also write each chunk as a ready-to-send MIME body with a plain-text alternative "
+                             "(chunk_XXX.eml), which the Cloud Function sends as-is")
+    parser.add_argument("--pack", action="store_true",
+                        help=f"Also write all of a book's chunks, as sent, into one {PACK_FILENAME} of gzip members; "
+                             "manifest.json gets each chunk's pack_offset/pack_length for ranged reads")
+    parser.add_argument("--stream", action="store_true",
+                        help="Spool chunk bodies to disk as they close instead of holding the whole book in memory")
+    parser.add_argument("--max-image-width", type=int, default=None,
+                        help="Downscale/recompress JPEG and PNG images wider than this many pixels (needs Pillow)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-stage time and call counts to book_output/<book_id>/profile.json; cached "
+                             "books are rebuilt to be measured (same as ISHMAEL_PROFILE=1)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Like --profile, plus per-stage peak memory via tracemalloc, which slows the build "
+                             "several times over (same as ISHMAEL_PROFILE=memory)")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Compare the soup and lxml engines on every book without writing output")
+    args = parser.parse_args()
+
     # Ensure output directory exists
     if not os.path.exists('book_output'):
         os.makedirs('book_output')
 
     # Process all EPUBs in books/ directory
-    books_dir = "books"
-    if os.path.exists(books_dir):
-        epub_files = [f for f in os.listdir(books_dir) if f.endswith(".epub")]
-        
-        if not epub_files:
-            print(f"No .epub files found in {books_dir}/")
-        
-        for epub_file in epub_files:
-            # Create a book_id from filename (e.g., "moby_dick.epub" -> "moby_dick")
+    if args.check_parity and os.path.exists(args.books_dir):
+        mismatched = 0
+        for epub_file in sorted(f for f in os.listdir(args.books_dir) if f.endswith(".epub")):
             book_id = os.path.splitext(epub_file)[0]
-            epub_path = os.path.join(books_dir, epub_file)
-            
-            print(f"--- Processing {book_id} ---")
-            process_epub(epub_path, book_id)
+            problems = check_parity(os.path.join(args.books_dir, epub_file), book_id, args.target_words)
+            if problems:
+                mismatched += 1
+                print(f"[{book_id}] {len(problems)} differences:")
+                for problem in problems[:20]:
+                    print(f"    {problem}")
+            else:
+                print(f"[{book_id}] engines agree")
+        sys.exit(1 if mismatched else 0)
+    elif os.path.exists(args.books_dir):
+        results = process_library(args.books_dir, jobs=args.jobs, force=args.force,
+                                  target_words=args.target_words, engine=args.engine, stream=args.stream,
+                                  max_image_width=args.max_image_width, doc_jobs=args.doc_jobs,
+                                  max_bytes=args.max_bytes, body_only=args.body_only, mime=args.mime, pack=args.pack,
+                                  profile="memory" if args.profile_memory else args.profile)
+        if any(r["error"] for r in results):
+            sys.exit(1)
     else:
-        print(f"Directory {books_dir} not found.")
+        print(f"Directory {args.books_dir} not found.")
@@ -0,0 +1,90 @@
+"""
+Ready-to-send MIME bodies for chunks, built once by the chunker.
+
+build_mime() turns a rendered chunk page into a multipart/alternative
+body with a generated text/plain part and the HTML part, already
+transfer-encoded to 7-bit-safe ASCII with CRLF line endings. It carries
+no addressing headers; the sender prepends From/To/Subject/Date/Message-ID
+and writes the bytes to SMTP as they are (see Mailer.send_raw). Standard
+library only.
+"""
+import hashlib
+import re
+import textwrap
+from html.parser import HTMLParser
+
+# Elements that start a new paragraph in the text/plain part
+BLOCK_TAGS = {"p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "li", "ul", "ol", "pre",
+              "table", "tr", "section", "article", "hgroup", "figure", "figcaption", "hr"}
+SKIP_TAGS = {"head", "style", "script", "title"}
+
+# Bumped when build_mime's output changes, so cached --mime builds are redone
+MIME_VERSION = 2
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._current = []
+        self._skip = 0
+        self._links = []  # open <a> tags: (href, text length when opened)
+
+    def _break(self):
+        text = re.sub(r"\s+", " ", "".join(self._current)).strip()
+        if text:
+            self.paragraphs.append(text)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self._break()
+        elif tag == "br":
+            self._current.append("\n")
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            self._current.append(f"[{alt}]" if alt else "[image]")
+        elif tag == "a":
+            self._links.append(dict(attrs).get("href"))
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self._break()
+        elif tag == "a" and self._links:
+            href = self._links.pop()
+            # Keep link targets (e.g. "Read this part online") usable in plain text
+            if href and href.startswith(("http://", "https://")):
+                self._current.append(f" <{href}>")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._current.append(data)
+
+def html_to_text(html, width=76):
+    """Plain-text rendering of a chunk page: one wrapped paragraph per block element."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    parser._break()
+    return "\n\n".join(textwrap.fill(p, width=width, break_long_words=False, break_on_hyphens=False)
+                       for p in parser.paragraphs) + "\n"
+
+def build_mime(html, text=None):
+    """Returns the multipart/alternative body (headers + parts) for a chunk page as bytes."""
+    from email import policy
+    from email.message import EmailMessage
+
+    if text is None:
+        text = html_to_text(html)
+    # 7bit: non-ASCII parts get quoted-printable/base64, never raw 8bit, which SMTP only allows
+    # with BODY=8BITMIME, and send_raw hands these bytes to sendmail as they are
+    msg = EmailMessage(policy=policy.SMTP.clone(cte_type="7bit"))
+    msg.set_content(text)
+    msg.add_alternative(html, subtype="html")
+    # A content-derived boundary keeps rebuilds byte-identical (the default one is random)
+    digest = hashlib.sha256((text + html).encode("utf-8")).hexdigest()[:32]
+    msg.set_boundary(f"ishmael-{digest}")
+    return msg.as_bytes()
@@ -0,0 +1,293 @@
+"""
+A small object-storage interface with three interchangeable backends, so
+state, chunk reads and uploads run the same way against a live bucket,
+a local directory or memory:
+
+- GCSStore: a Google Cloud Storage bucket (google-cloud-storage is
+  imported on first use, keeping it off the Cloud Function's cold start).
+- LocalStore: files under a directory; object names are relative paths.
+- MemoryStore: a dict, for benchmarks and load tests.
+
+Every backend offers get/get_range/put/exists/list/delete. put() takes an
+if_generation_match precondition (0 = "only if it doesn't exist yet")
+and raises PreconditionFailed when it doesn't hold; get() raises
+ObjectNotFound. Objects stored with content_encoding="gzip" are returned
+inflated by get(); get_range() returns stored bytes as they are.
+open_store() picks a backend from a location string.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+# What list() returns per object. md5_hash is base64 of the stored bytes' MD5, as GCS reports it
+ObjectInfo = namedtuple("ObjectInfo", ["name", "size", "generation", "md5_hash", "metadata"])
+
+class ObjectNotFound(Exception):
+    pass
+
+class PreconditionFailed(Exception):
+    pass
+
+def _md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+def _decode(data, content_encoding):
+    return gzip.decompress(data) if content_encoding == "gzip" else data
+
+class GCSStore:
+    def __init__(self, bucket_name=None, bucket=None, client=None):
+        # Callers that already hold a bucket (e.g. a warm Cloud Function instance)
+        # pass it in to skip credential discovery and a fresh HTTP session
+        if bucket is None:
+            if client is None:
+                from google.cloud import storage
+                client = storage.Client()
+            bucket = client.bucket(bucket_name)
+        self.bucket = bucket
+
+    def __repr__(self):
+        return f"gs://{self.bucket.name}"
+
+    def get(self, name):
+        """Returns (data, generation). One request; the generation comes from the download headers."""
+        from google.api_core.exceptions import NotFound
+
+        blob = self.bucket.blob(name)
+        try:
+            # Fetched raw so gzip-encoded objects are inflated once, here, whatever the client does
+            data = blob.download_as_bytes(raw_download=True)
+        except NotFound:
+            raise ObjectNotFound(name)
+        return _decode(data, blob.content_encoding), blob.generation
+
+    def get_range(self, name, start, end):
+        """Stored bytes start..end (inclusive) in one ranged request."""
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return self.bucket.blob(name).download_as_bytes(start=start, end=end, raw_download=True)
+        except NotFound:
+            raise ObjectNotFound(name)
+
+    def put(self, name, data, content_type=None, content_encoding=None, metadata=None, if_generation_match=None):
+        """Stores data as-is (already compressed if content_encoding is set); returns the new generation."""
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+
+        blob = self.bucket.blob(name)
+        if content_encoding:
+            blob.content_encoding = content_encoding
+        if metadata:
+            blob.metadata = metadata
+        try:
+            blob.upload_from_string(data, content_type=content_type or "application/octet-stream",
+                                    if_generation_match=if_generation_match)
+        except GCSPreconditionFailed:
+            raise PreconditionFailed(name)
+        return blob.generation
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def list(self, prefix=""):
+        return [ObjectInfo(blob.name, blob.size, blob.generation, blob.md5_hash, blob.metadata or {})
+                for blob in self.bucket.list_blobs(prefix=prefix)]
+
+    def delete(self, name):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            raise ObjectNotFound(name)
+
+class LocalStore:
+    """
+    Objects are plain files under root, so a LocalStore(".") reads and
+    writes sending_state.json in the working directory exactly like the
+    old local fallback. Content encoding and custom metadata, when given,
+    go in a sidecar under root/.meta/. The generation is the file's
+    mtime in nanoseconds; preconditions are checked under a lock, so they
+    hold between threads of one process, not between processes.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def __repr__(self):
+        return f"file://{os.path.abspath(self.root)}"
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def _meta_path(self, name):
+        return os.path.join(self.root, ".meta", *name.split("/")) + ".json"
+
+    def _meta(self, name):
+        try:
+            with open(self._meta_path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _generation(self, name):
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def get(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+                # From the open file: put() replaces the path, so a second stat could see a newer
+                # object than the bytes just read
+                generation = os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+        return _decode(data, self._meta(name).get("content_encoding")), generation
+
+    def get_range(self, name, start, end):
+        try:
+            with open(self._path(name), "rb") as f:
+                f.seek(start)
+                return f.read(end - start + 1)
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def put(self, name, data, content_type=None, content_encoding=None, metadata=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            previous = self._generation(name)
+            if if_generation_match is not None and if_generation_match != previous:
+                raise PreconditionFailed(name)
+
+            # Write-then-rename, so readers never see a partial object (or its generation before the bump)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            generation = os.stat(tmp).st_mtime_ns
+            if generation <= previous:
+                # Coarse filesystem timestamps: make sure every write gets a new generation
+                generation = previous + 1
+                os.utime(tmp, ns=(generation, generation))
+            os.replace(tmp, path)
+
+            meta_path = self._meta_path(name)
+            if content_encoding or metadata:
+                os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"content_encoding": content_encoding, "metadata": metadata or {}}, f)
+            elif os.path.exists(meta_path):
+                os.remove(meta_path)
+        return generation
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def list(self, prefix=""):
+        # Only walk the directory the prefix points into
+        start = self._path(prefix.rsplit("/", 1)[0]) if "/" in prefix else self.root
+        infos = []
+        for dirpath, dirnames, filenames in os.walk(start):
+            dirnames[:] = sorted(d for d in dirnames if d != ".meta")
+            for filename in sorted(filenames):
+                if filename.startswith(".tmp-"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if not name.startswith(prefix):
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                    generation = os.fstat(f.fileno()).st_mtime_ns
+                infos.append(ObjectInfo(name, len(data), generation, _md5(data),
+                                        self._meta(name).get("metadata") or {}))
+        return infos
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+        if os.path.exists(self._meta_path(name)):
+            os.remove(self._meta_path(name))
+
+class MemoryStore:
+    def __init__(self):
+        self.objects = {}  # name -> {"data", "generation", "content_type", "content_encoding", "metadata"}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def __repr__(self):
+        return "memory://"
+
+    def get(self, name):
+        obj = self.objects.get(name)
+        if obj is None:
+            raise ObjectNotFound(name)
+        return _decode(obj["data"], obj["content_encoding"]), obj["generation"]
+
+    def get_range(self, name, start, end):
+        obj = self.objects.get(name)
+        if obj is None:
+            raise ObjectNotFound(name)
+        return obj["data"][start:end + 1]
+
+    def put(self, name, data, content_type=None, content_encoding=None, metadata=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            current = self.objects.get(name)
+            if if_generation_match is not None and if_generation_match != (current["generation"] if current else 0):
+                raise PreconditionFailed(name)
+            self._generation += 1
+            self.objects[name] = {"data": data, "generation": self._generation, "content_type": content_type,
+                                  "content_encoding": content_encoding, "metadata": dict(metadata or {})}
+            return self._generation
+
+    def exists(self, name):
+        return name in self.objects
+
+    def list(self, prefix=""):
+        with self._lock:
+            items = sorted((n, o) for n, o in self.objects.items() if n.startswith(prefix))
+        return [ObjectInfo(n, len(o["data"]), o["generation"], _md5(o["data"]), o["metadata"]) for n, o in items]
+
+    def delete(self, name):
+        with self._lock:
+            if self.objects.pop(name, None) is None:
+                raise ObjectNotFound(name)
+
+def open_store(location=None):
+    """
+    Returns a store for location:
+      None                    -> LocalStore(".") (the working directory)
+      "gs://<bucket>"         -> GCSStore
+      "file://<dir>" or a path with a "/" (or "." / "..") -> LocalStore
+      "memory://"             -> a new, empty MemoryStore
+      any other name          -> GCSStore for that bucket name
+    A store object is returned as-is.
+    """
+    if location is None:
+        return LocalStore(".")
+    if not isinstance(location, str):
+        return location
+    if location.startswith("gs://"):
+        return GCSStore(location[len("gs://"):].rstrip("/"))
+    if location.startswith("file://"):
+        return LocalStore(location[len("file://"):] or ".")
+    if location == "memory://":
+        return MemoryStore()
+    if "/" in location or os.sep in location or location in (".", ".."):
+        return LocalStore(location)
+    return GCSStore(location)
@@ -0,0 +1,113 @@
+"""
+Lightweight per-stage instrumentation for the chunking pipeline.
+
+Code marks its stages with `with stage("parse"):`. That costs nothing
+unless a StageProfiler is active, which html_chunker does per book when
+run with --profile (or ISHMAEL_PROFILE=1). Stages nest; each one reports
+its own time excluding nested stages, so the stage times of a book add up
+to its wall time (minus 'unattributed_seconds').
+
+Peak memory per stage comes from tracemalloc, which slows a build several
+times over and would swamp the timings, so it is only traced with
+--profile-memory (or ISHMAEL_PROFILE=memory).
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+_NULL_STAGE = nullcontext()
+_active = None
+
+class StageProfiler:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.extra = {}  # free-form fields copied into the report
+        self.stages = {}
+        self._stack = []
+        self._thread = threading.get_ident()
+        self._started = time.perf_counter()
+
+    def _fold_peak(self):
+        # tracemalloc keeps one global peak; push it into every open stage before resetting
+        if not self.trace_memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self._stack:
+            frame["peak"] = max(frame["peak"], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        self._fold_peak()
+        frame = {"name": name, "start": time.perf_counter(), "child": 0.0, "peak": 0}
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._fold_peak()
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame["start"]
+            if self._stack:
+                self._stack[-1]["child"] += elapsed
+
+            stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "peak_bytes": 0})
+            stats["calls"] += 1
+            stats["seconds"] += elapsed - frame["child"]
+            stats["peak_bytes"] = max(stats["peak_bytes"], frame["peak"])
+
+    def report(self):
+        total = time.perf_counter() - self._started
+        stages = {name: dict(stats, seconds=round(stats["seconds"], 6)) for name, stats in self.stages.items()}
+        if not self.trace_memory:
+            for stats in stages.values():
+                stats.pop("peak_bytes")
+        # ru_maxrss is KiB on Linux but bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            max_rss *= 1024
+        return dict(self.extra, **{
+            "total_seconds": round(total, 6),
+            "unattributed_seconds": round(total - sum(s["seconds"] for s in self.stages.values()), 6),
+            "peak_rss_bytes": max_rss,
+            "stages": stages,
+        })
+
+def stage(name):
+    """Context manager timing `name` on the active profiler (a no-op when none is active)."""
+    profiler = _active
+    if profiler is None or profiler._thread != threading.get_ident():
+        return _NULL_STAGE
+    return profiler.stage(name)
+
+def profiling_enabled(flag=False):
+    return bool(flag) or os.environ.get("ISHMAEL_PROFILE", "") not in ("", "0")
+
+def memory_profiling_enabled(flag=False):
+    """Whether to trace peak memory too: flag == "memory" or ISHMAEL_PROFILE=memory."""
+    return flag == "memory" or os.environ.get("ISHMAEL_PROFILE", "") == "memory"
+
+@contextmanager
+def profile_to(report_path, extra=None, trace_memory=False):
+    """Activates a StageProfiler for the block and writes its JSON report to report_path."""
+    global _active
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    previous, _active = _active, StageProfiler(trace_memory=trace_memory)
+    profiler = _active
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        if started_tracing:
+            tracemalloc.stop()
+        profiler.extra = dict(extra or {}, **profiler.extra)
+        report = profiler.report()
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -1,63 +1,223 @@
 import json
-import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.cloud import storage
+
+# Imported as src.state_manager from the package and as state_manager by the scripts
+try:
+    from .object_store import open_store, ObjectNotFound, PreconditionFailed
+except ImportError:
+    from object_store import open_store, ObjectNotFound, PreconditionFailed
 
 STATE_FILE = "sending_state.json"
+# Sharded layout: one object per book; its 'active' flag is mirrored into the
+# object's custom metadata so a single listing finds the active books
+STATE_PREFIX = "state/books/"
 
-def load_state(bucket_name=None):
-    if bucket_name:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(STATE_FILE)
-        if blob.exists():
-            return json.loads(blob.download_as_string())
-        return {}
-    
-    # Fallback to local file
-    if not os.path.exists(STATE_FILE):
-        return {}
-    with open(STATE_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_state(state, bucket_name=None):
-    if bucket_name:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(STATE_FILE)
-        blob.upload_from_string(json.dumps(state, indent=4))
-        return
-
-    # Fallback to local file
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=4)
-
-def get_last_chunk_id(book_title, bucket_name=None):
-    state = load_state(bucket_name)
+# Every function takes a store: an object_store backend, or a location for
+# open_store() (a bucket name, gs://..., a directory). None is the working
+# directory, i.e. a local sending_state.json.
+
+def _dump(state):
+    return json.dumps(state, indent=4).encode("utf-8")
+
+def load_state(store=None):
+    return open_state_session(store).state
+
+def save_state(state, store=None):
+    open_store(store).put(STATE_FILE, _dump(state), content_type="application/json")
+
+def get_last_chunk_id(book_title, store=None):
+    state = open_state_session(store, books=[book_title]).state
     return state.get(book_title, {}).get("last_chunk_id", 0)
 
-def update_state(book_title, chunk_id, bucket_name=None):
-    state = load_state(bucket_name)
-    
-    # Get existing book state or initialize
-    book_state = state.get(book_title, {})
-    
-    # Update fields (preserving others like 'active')
-    book_state["last_chunk_id"] = chunk_id
-    book_state["last_sent_at"] = datetime.now().isoformat()
-    
-    state[book_title] = book_state
-    save_state(state, bucket_name)
-
-def set_book_active(book_title, active: bool, bucket_name=None):
-    state = load_state(bucket_name)
-    
-    # Get existing book state or initialize
-    book_state = state.get(book_title, {})
-    book_state["active"] = active
-    
-    state[book_title] = book_state
-    save_state(state, bucket_name)
+class StateSession:
+    """
+    One read-modify-write of the state file. The state is loaded once,
+    per-book field updates are recorded in memory and commit() uploads
+    them in a single write guarded by if_generation_match. If someone
+    else (e.g. set_active_book.py) wrote in between, the file is re-read,
+    the recorded updates are re-applied on top of it and the write is
+    retried, so concurrent changes to other fields are never lost.
+    """
+
+    def __init__(self, store=None, max_attempts=5):
+        self.store = open_store(store)
+        self.max_attempts = max_attempts
+        self.changes = {}  # book_id -> {field: value}
+        self.state, self.generation = self._load()
+
+    def _load(self):
+        try:
+            data, generation = self.store.get(STATE_FILE)
+        except ObjectNotFound:
+            # Generation 0 means "only write if the file still doesn't exist"
+            return {}, 0
+        # The read returns the object's generation too; no extra metadata request
+        return json.loads(data), generation
+
+    def update(self, book_id, **fields):
+        self.changes.setdefault(book_id, {}).update(fields)
+        self.state.setdefault(book_id, {}).update(fields)
+
+    def record_sent(self, book_id, chunk_id):
+        # Preserves other fields like 'active'
+        self.update(book_id, last_chunk_id=chunk_id, last_sent_at=datetime.now().isoformat())
+
+    def set_active(self, book_id, active: bool):
+        self.update(book_id, active=active)
+
+    def commit(self):
+        """Writes the recorded updates; returns the number of attempts it took."""
+        if not self.changes:
+            return 0
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.generation = self.store.put(STATE_FILE, _dump(self.state), content_type="application/json",
+                                                 if_generation_match=self.generation)
+                self.changes = {}
+                return attempt
+            except PreconditionFailed:
+                if attempt == self.max_attempts:
+                    raise
+                print(f"State changed since it was read (attempt {attempt}); merging and retrying")
+                time.sleep(random.uniform(0, 0.1 * attempt))
+                self.state, self.generation = self._load()
+                for book_id, fields in self.changes.items():
+                    self.state.setdefault(book_id, {}).update(fields)
+
+def _shard_name(book_id):
+    return f"{STATE_PREFIX}{book_id}.json"
+
+def _list_shards(store):
+    """{book_id: active} for every per-book state object, from one listing."""
+    shards = {}
+    for info in store.list(STATE_PREFIX):
+        if info.name.endswith(".json"):
+            shards[info.name[len(STATE_PREFIX):-len(".json")]] = info.metadata.get("active") == "true"
+    return shards
+
+class ShardedStateSession:
+    """
+    StateSession's interface over one state object per book
+    (state/books/<book_id>.json). Each book is read and written on its
+    own, with its own generation precondition and merge-and-retry, so
+    updates to different books never contend on one object. With
+    active_only, inactive books are not downloaded; they appear in
+    .state as {"active": False} and are fetched if they get updated.
+    """
+
+    def __init__(self, store, shards, active_only=False, max_attempts=5, workers=8):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.workers = workers
+        self.changes = {}  # book_id -> {field: value}
+        self.generations = {}  # book_id -> generation of the copy in self.state
+
+        self.state = {book_id: {"active": False} for book_id, active in shards.items() if active_only and not active}
+        to_load = [book_id for book_id in shards if book_id not in self.state]
+        for book_id, (data, generation) in zip(to_load, self._map(self._load_book, to_load)):
+            self.state[book_id] = data
+            self.generations[book_id] = generation
+
+    def _map(self, fn, items):
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            return list(executor.map(fn, items))
+
+    def _load_book(self, book_id):
+        try:
+            data, generation = self.store.get(_shard_name(book_id))
+        except ObjectNotFound:
+            return {}, 0
+        return json.loads(data), generation
+
+    def update(self, book_id, **fields):
+        self.changes.setdefault(book_id, {}).update(fields)
+        self.state.setdefault(book_id, {}).update(fields)
+
+    def record_sent(self, book_id, chunk_id):
+        # Preserves other fields like 'active'
+        self.update(book_id, last_chunk_id=chunk_id, last_sent_at=datetime.now().isoformat())
+
+    def set_active(self, book_id, active: bool):
+        self.update(book_id, active=active)
+
+    def _commit_book(self, book_id):
+        fields = self.changes[book_id]
+        for attempt in range(1, self.max_attempts + 1):
+            if book_id not in self.generations:
+                # Never downloaded (inactive placeholder, new book) or lost a race: start from the stored copy
+                data, self.generations[book_id] = self._load_book(book_id)
+                data.update(fields)
+                self.state[book_id] = data
+
+            metadata = {"active": "true" if self.state[book_id].get("active") else "false"}
+            try:
+                self.generations[book_id] = self.store.put(
+                    _shard_name(book_id), _dump(self.state[book_id]), content_type="application/json",
+                    metadata=metadata, if_generation_match=self.generations[book_id])
+                return attempt
+            except PreconditionFailed:
+                if attempt == self.max_attempts:
+                    raise
+                print(f"[{book_id}] State changed since it was read (attempt {attempt}); merging and retrying")
+                time.sleep(random.uniform(0, 0.1 * attempt))
+                del self.generations[book_id]
+
+    def commit(self):
+        """Writes each changed book's object; returns the most attempts any book took."""
+        if not self.changes:
+            return 0
+        attempts = self._map(self._commit_book, list(self.changes))
+        self.changes = {}
+        return max(attempts)
+
+def open_state_session(store=None, active_only=False, books=None):
+    """
+    Returns a ShardedStateSession once the store has per-book state objects
+    (see migrate_to_sharded), else a StateSession on sending_state.json.
+    With books, a sharded session only downloads those books' objects (one
+    request each) and .state holds just them.
+    """
+    store = open_store(store)
+    if books is not None:
+        session = ShardedStateSession(store, {book_id: True for book_id in books})
+        # A book with its own state object settles the layout; only new books need the listing
+        if any(session.generations.values()) or _list_shards(store):
+            return session
+        return StateSession(store)
+    shards = _list_shards(store)
+    if shards:
+        return ShardedStateSession(store, shards, active_only=active_only)
+    return StateSession(store)
+
+def migrate_to_sharded(store=None):
+    """
+    Copies every book in sending_state.json into its own state object. Books
+    that already have one are left alone, so it is safe to re-run. Returns
+    the migrated book ids.
+    """
+    store = open_store(store)
+    existing = _list_shards(store)
+    legacy = StateSession(store)
+
+    session = ShardedStateSession(store, {})
+    for book_id, book_state in legacy.state.items():
+        if book_id not in existing:
+            session.update(book_id, **book_state)
+    migrated = list(session.changes)
+    session.commit()
+    return migrated
+
+def update_state(book_title, chunk_id, store=None):
+    session = open_state_session(store, books=[book_title])
+    session.record_sent(book_title, chunk_id)
+    session.commit()
+
+def set_book_active(book_title, active: bool, store=None):
+    session = open_state_session(store, books=[book_title])
+    session.set_active(book_title, active)
+    session.commit()
@@ -0,0 +1,63 @@
+import os
+import sys
+import socket
+import smtplib
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
+os.environ.setdefault("K_SERVICE", "test")  # no .env lookup
+from local_services import SMTPSink
+from src.emailer import Mailer, _session_dropped
+
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class MailerRetryTest(unittest.TestCase):
+    def start_sink(self, **kwargs):
+        sink = SMTPSink(**kwargs).start()
+        self.addCleanup(sink.stop)
+        return sink
+
+    def mailer(self, sink):
+        mailer = Mailer("sender@example.com", "secret", host="127.0.0.1", port=sink.port, starttls=False)
+        self.addCleanup(mailer.close)
+        return mailer
+
+    def test_refused_message_is_not_resent(self):
+        sink = self.start_sink(failure_rate=1.0, failure_reply="550 5.1.1 Mailbox unavailable")
+        mailer = self.mailer(sink)
+
+        with self.assertRaises(smtplib.SMTPDataError) as raised:
+            mailer.send("reader@example.com", "Moby Dick - Part 1", "<p>Call me Ishmael.</p>")
+        self.assertEqual(raised.exception.smtp_code, 550)
+        self.assertEqual(mailer.connections, 1)
+        self.assertEqual(sink.connections, 1)
+        self.assertEqual(sink.rejected, 1)
+
+    def test_dropped_session_is_replaced(self):
+        sink = self.start_sink()
+        mailer = self.mailer(sink)
+        mailer.send("reader@example.com", "Moby Dick - Part 1", "<p>Call me Ishmael.</p>")
+        # The pooled session's socket goes away, as after a server-side idle timeout
+        mailer._idle[0].sock.shutdown(socket.SHUT_RDWR)
+
+        mailer.send("reader@example.com", "Moby Dick - Part 2", "<p>Some years ago.</p>")
+        self.assertEqual(mailer.connections, 2)
+        self.assertEqual(len(sink.messages), 2)
+
+class SessionDroppedTest(unittest.TestCase):
+    def test_retries_only_connection_failures(self):
+        self.assertTrue(_session_dropped(smtplib.SMTPServerDisconnected("Connection unexpectedly closed")))
+        self.assertTrue(_session_dropped(smtplib.SMTPResponseException(421, b"Service closing channel")))
+        self.assertTrue(_session_dropped(ConnectionResetError()))
+        self.assertTrue(_session_dropped(TimeoutError()))
+
+        self.assertFalse(_session_dropped(smtplib.SMTPDataError(550, b"Mailbox unavailable")))
+        self.assertFalse(_session_dropped(smtplib.SMTPDataError(451, b"Try again later")))
+        self.assertFalse(_session_dropped(smtplib.SMTPRecipientsRefused({"reader@example.com": (550, b"No")})))
+        self.assertFalse(_session_dropped(smtplib.SMTPAuthenticationError(535, b"Bad credentials")))
+        self.assertFalse(_session_dropped(ValueError()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import filecmp
+import tempfile
+import zipfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.html_chunker import Block, process_epub, check_parity, process_library, _process_book, split_documents
+
+WORDS = "whale sea ship captain harpoon deck mast sail storm wave island harbor".split()
+
+def write_epub(path, docs=3, paragraphs=30, words=40, body_tag="<body>", headings=True):
+    """A minimal EPUB; real books often use a bare <body>, which get_body_content() strips."""
+    manifest, spine = [], []
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip")
+        z.writestr("META-INF/container.xml",
+                   '<?xml version="1.0"?>\n'
+                   '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                   '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                   '</rootfiles></container>')
+        for d in range(docs):
+            body = [f"<h2>CHAPTER {d + 1}.</h2>"] if headings else []
+            body += [f"<p>{' '.join(WORDS[(d + p + w) % len(WORDS)] for w in range(words))}</p>"
+                     for p in range(paragraphs)]
+            z.writestr(f"OEBPS/doc_{d}.xhtml",
+                       '<?xml version="1.0" encoding="utf-8"?>\n'
+                       '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>doc</title></head>'
+                       f'{body_tag}{"".join(body)}</body></html>')
+            manifest.append(f'<item id="doc{d}" href="doc_{d}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="doc{d}"/>')
+        z.writestr("OEBPS/content.opf",
+                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+                   '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                   '<dc:identifier id="id">test</dc:identifier><dc:title>Test Book</dc:title>'
+                   '<dc:language>en</dc:language></metadata>'
+                   f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>')
+
+def paragraph(size):
+    return Block(html=f"<p>{'x' * (size - 7)}</p>", word_count=size // 5, image_count=0, heading_text=None, tag="p")
+
+def heading(text):
+    return Block(html=f"<h2>{text}</h2>", word_count=len(text.split()), image_count=0, heading_text=text, tag="h2")
+
+class SplitDocumentsTest(unittest.TestCase):
+    def test_byte_budget_never_leaves_a_heading_alone(self):
+        # The heading itself goes over the budget, then the next paragraph nearly fills a chunk on its own
+        documents = [[paragraph(990), heading("Chapter 2"), paragraph(980), paragraph(500)]]
+        chunks = list(split_documents(documents, target_words=100_000, max_body_bytes=1000))
+
+        self.assertEqual([[b.tag for b in chunk["blocks"]] for chunk in chunks], [["p"], ["h2", "p"], ["p"]])
+        self.assertEqual(chunks[1]["chapters"], ["Chapter 2"])
+
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class ChunkerTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        # The chunker writes to book_output/ under the working directory
+        os.chdir(tmp.name)
+        self.tmp = tmp.name
+
+    def test_bare_body_with_both_engines(self):
+        for body_tag in ("<body>", '<body class="chapter">'):
+            write_epub("book.epub", body_tag=body_tag)
+            counts = {engine: process_epub("book.epub", f"book_{engine}", target_words=1000, engine=engine)
+                      for engine in ("soup", "lxml")}
+            self.assertGreater(counts["soup"], 1, body_tag)
+            self.assertEqual(counts["soup"], counts["lxml"], body_tag)
+            self.assertEqual(check_parity("book.epub", "book", target_words=1000), [], body_tag)
+
+    def test_legacy_images_are_kept(self):
+        # Emails already delivered link to <book_id>/images/<name> from builds before the asset store
+        os.makedirs("book_output/book/images")
+        with open("book_output/book/images/illustration.jpg", "wb") as f:
+            f.write(b"jpeg")
+        write_epub("book.epub")
+        process_epub("book.epub", "book", target_words=1000)
+        self.assertTrue(os.path.exists("book_output/book/images/illustration.jpg"))
+
+    @mock.patch.dict(os.environ, {"ISHMAEL_PROFILE": ""})
+    def test_profile_rebuilds_cached_books_without_tracing_memory(self):
+        os.makedirs("books")
+        write_epub("books/book.epub")
+        process_library("books", target_words=1000)
+        self.assertFalse(os.path.exists("book_output/book/profile.json"))
+
+        [result] = process_library("books", target_words=1000, profile=True)
+        self.assertFalse(result["skipped"])
+        with open("book_output/book/profile.json", encoding="utf-8") as f:
+            report = json.load(f)
+        self.assertIn("parse", report["stages"])
+        self.assertNotIn("peak_bytes", report["stages"]["parse"])
+
+        process_library("books", target_words=1000, profile="memory")
+        with open("book_output/book/profile.json", encoding="utf-8") as f:
+            self.assertIn("peak_bytes", json.load(f)["stages"]["parse"])
+
+    def test_book_without_chunks_fails(self):
+        write_epub("empty.epub", paragraphs=0, headings=False)
+        result = _process_book("empty.epub", "empty")
+        self.assertIn("No chunks produced", result["error"])
+        self.assertIsNone(result["cache"])
+
+    def test_parallel_build_matches_serial(self):
+        os.makedirs("books")
+        for i in range(3):
+            write_epub(f"books/book_{i}.epub", docs=4 + i)
+        outputs = {}
+        for jobs in (1, 3):
+            os.makedirs(f"run_{jobs}")
+            os.chdir(f"run_{jobs}")
+            process_library("../books", jobs=jobs, target_words=1000)
+            os.chdir(self.tmp)
+            outputs[jobs] = os.path.join(self.tmp, f"run_{jobs}", "book_output")
+
+        compare = filecmp.dircmp(outputs[1], outputs[3], ignore=[".build_cache.json"])
+        self.assertEqual(sorted(os.listdir(outputs[1])), sorted(os.listdir(outputs[3])))
+        for book_id in os.listdir(outputs[1]):
+            if book_id.startswith("."):
+                continue
+            names = sorted(os.listdir(os.path.join(outputs[1], book_id)))
+            match, mismatch, errors = filecmp.cmpfiles(os.path.join(outputs[1], book_id),
+                                                       os.path.join(outputs[3], book_id), names, shallow=False)
+            self.assertEqual((mismatch, errors), ([], []), book_id)
+        self.assertEqual(compare.left_only + compare.right_only, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("K_SERVICE", "test")  # no .env lookup
+import main
+
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class DispatchConcurrencyTest(unittest.TestCase):
+    def concurrency(self, value):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("DISPATCH_CONCURRENCY", None)
+            if value is not None:
+                os.environ["DISPATCH_CONCURRENCY"] = value
+            return main.dispatch_concurrency()
+
+    def test_parses_the_env_var(self):
+        self.assertEqual(self.concurrency("3"), 3)
+        self.assertEqual(self.concurrency("0"), 1)
+
+    def test_falls_back_to_the_default(self):
+        for value in (None, "", "eight", "2.5"):
+            self.assertEqual(self.concurrency(value), main.DEFAULT_DISPATCH_CONCURRENCY)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import email
+import unittest
+from email import policy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.mime_chunk import build_mime
+
+class BuildMimeTest(unittest.TestCase):
+    def test_non_ascii_parts_are_7bit_safe(self):
+        # Short lines of non-ASCII text: policy.SMTP alone would emit them as raw 8bit
+        html = "<html><body><p>Café — «Ishmael»</p>\n<p>Naïve señor</p></body></html>"
+        body = build_mime(html)
+        self.assertTrue(body.isascii())
+
+        msg = email.message_from_bytes(body, policy=policy.default)
+        parts = [part for part in msg.walk() if not part.is_multipart()]
+        self.assertEqual([part.get_content_type() for part in parts], ["text/plain", "text/html"])
+        for part in parts:
+            self.assertIn(part["Content-Transfer-Encoding"], ("7bit", "quoted-printable", "base64"))
+        self.assertEqual(parts[1].get_content().replace("\r\n", "\n"), html + "\n")
+        self.assertIn("Café — «Ishmael»", parts[0].get_content())
+
+    def test_rebuilds_are_byte_identical(self):
+        html = "<html><body><p>Call me Ishmael.</p></body></html>"
+        self.assertEqual(build_mime(html), build_mime(html))
+
+if __name__ == "__main__":
+    unittest.main()
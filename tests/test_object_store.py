@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.object_store import LocalStore, PreconditionFailed
+
+class LocalStoreGenerationTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = LocalStore(tmp.name)
+
+    def test_get_returns_the_generation_put_returned(self):
+        generations = [self.store.put("state/books/moby_dick.json", f'{{"last_chunk_id": {i}}}') for i in range(20)]
+        self.assertEqual(generations, sorted(set(generations)))
+        data, generation = self.store.get("state/books/moby_dick.json")
+        self.assertEqual(data, b'{"last_chunk_id": 19}')
+        self.assertEqual(generation, generations[-1])
+        self.assertEqual([info.generation for info in self.store.list("state/")], [generations[-1]])
+
+    def test_precondition_on_the_generation_read(self):
+        self.store.put("sending_state.json", b"{}")
+        _, generation = self.store.get("sending_state.json")
+        self.store.put("sending_state.json", b'{"moby_dick": {}}', if_generation_match=generation)
+        with self.assertRaises(PreconditionFailed):
+            self.store.put("sending_state.json", b"{}", if_generation_match=generation)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.object_store import MemoryStore, PreconditionFailed
+from src.state_manager import STATE_FILE, StateSession, ShardedStateSession, _shard_name, set_book_active
+
+class RacingStore(MemoryStore):
+    """Runs `writer` (another process's write) right before each of the next `races` conditional puts."""
+
+    def __init__(self, writer, races=1):
+        super().__init__()
+        self.writer = writer
+        self.races = races
+        self.conditional_puts = 0
+
+    def put(self, name, data, if_generation_match=None, **kwargs):
+        if if_generation_match is not None:
+            self.conditional_puts += 1
+            if self.races:
+                self.races -= 1
+                self.writer(self)
+        return super().put(name, data, if_generation_match=if_generation_match, **kwargs)
+
+def read_json(store, name):
+    return json.loads(store.get(name)[0])
+
+@mock.patch("src.state_manager.time.sleep", lambda seconds: None)
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class StateSessionCommitTest(unittest.TestCase):
+    def seed(self, store):
+        MemoryStore.put(store, STATE_FILE, json.dumps({"moby_dick": {"active": True, "last_chunk_id": 3}}))
+
+    def test_merges_a_concurrent_write(self):
+        def writer(store):
+            state = read_json(store, STATE_FILE)
+            state["moby_dick"]["paused_by"] = "set_active_book"
+            state["a_farewell_to_arms"] = {"active": True}
+            MemoryStore.put(store, STATE_FILE, json.dumps(state))
+
+        store = RacingStore(writer)
+        self.seed(store)
+        session = StateSession(store)
+        session.record_sent("moby_dick", 4)
+
+        self.assertEqual(session.commit(), 2)
+        state = read_json(store, STATE_FILE)
+        self.assertEqual(state["moby_dick"]["last_chunk_id"], 4)
+        self.assertEqual(state["moby_dick"]["paused_by"], "set_active_book")
+        self.assertEqual(state["a_farewell_to_arms"], {"active": True})
+
+    def test_gives_up_after_max_attempts(self):
+        def writer(store):
+            MemoryStore.put(store, STATE_FILE, store.get(STATE_FILE)[0])
+
+        store = RacingStore(writer, races=10)
+        self.seed(store)
+        session = StateSession(store, max_attempts=3)
+        session.record_sent("moby_dick", 4)
+
+        with self.assertRaises(PreconditionFailed):
+            session.commit()
+        self.assertEqual(store.conditional_puts, 3)
+        self.assertEqual(read_json(store, STATE_FILE)["moby_dick"]["last_chunk_id"], 3)
+
+@mock.patch("src.state_manager.time.sleep", lambda seconds: None)
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class ShardedStateSessionCommitTest(unittest.TestCase):
+    def seed(self, store):
+        MemoryStore.put(store, _shard_name("moby_dick"), json.dumps({"active": True, "last_chunk_id": 3}),
+                        metadata={"active": "true"})
+
+    def test_merges_a_concurrent_write(self):
+        def writer(store):
+            book = read_json(store, _shard_name("moby_dick"))
+            book["paused_by"] = "set_active_book"
+            MemoryStore.put(store, _shard_name("moby_dick"), json.dumps(book), metadata={"active": "true"})
+
+        store = RacingStore(writer)
+        self.seed(store)
+        session = ShardedStateSession(store, {"moby_dick": True})
+        session.record_sent("moby_dick", 4)
+
+        self.assertEqual(session._commit_book("moby_dick"), 2)
+        book = read_json(store, _shard_name("moby_dick"))
+        self.assertEqual(book["last_chunk_id"], 4)
+        self.assertEqual(book["paused_by"], "set_active_book")
+        self.assertEqual(store.objects[_shard_name("moby_dick")]["metadata"], {"active": "true"})
+
+    def test_gives_up_after_max_attempts(self):
+        def writer(store):
+            MemoryStore.put(store, _shard_name("moby_dick"), store.get(_shard_name("moby_dick"))[0],
+                            metadata={"active": "true"})
+
+        store = RacingStore(writer, races=10)
+        self.seed(store)
+        session = ShardedStateSession(store, {"moby_dick": True}, max_attempts=3)
+        session.record_sent("moby_dick", 4)
+
+        with self.assertRaises(PreconditionFailed):
+            session._commit_book("moby_dick")
+        self.assertEqual(store.conditional_puts, 3)
+        self.assertEqual(read_json(store, _shard_name("moby_dick"))["last_chunk_id"], 3)
+
+class CountingStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.gets = []
+        self.lists = 0
+
+    def get(self, name):
+        self.gets.append(name)
+        return super().get(name)
+
+    def list(self, prefix=""):
+        self.lists += 1
+        return super().list(prefix)
+
+class SingleBookUpdateTest(unittest.TestCase):
+    def test_sharded_update_reads_only_that_book(self):
+        store = CountingStore()
+        for i in range(50):
+            MemoryStore.put(store, _shard_name(f"book_{i:02d}"), json.dumps({"active": True}),
+                            metadata={"active": "true"})
+
+        set_book_active("book_07", False, store=store)
+        self.assertEqual(store.gets, [_shard_name("book_07")])
+        self.assertEqual(store.lists, 0)
+        self.assertEqual(read_json(store, _shard_name("book_07")), {"active": False})
+        self.assertEqual(store.objects[_shard_name("book_07")]["metadata"], {"active": "false"})
+
+    def test_new_book_in_a_sharded_store(self):
+        store = CountingStore()
+        MemoryStore.put(store, _shard_name("moby_dick"), json.dumps({"active": True}), metadata={"active": "true"})
+
+        set_book_active("a_farewell_to_arms", True, store=store)
+        self.assertEqual(read_json(store, _shard_name("a_farewell_to_arms")), {"active": True})
+        self.assertFalse(store.exists(STATE_FILE))
+
+    def test_legacy_state_file(self):
+        store = CountingStore()
+        MemoryStore.put(store, STATE_FILE, json.dumps({"moby_dick": {"active": True, "last_chunk_id": 3}}))
+
+        set_book_active("moby_dick", False, store=store)
+        self.assertEqual(read_json(store, STATE_FILE), {"moby_dick": {"active": False, "last_chunk_id": 3}})
+        self.assertEqual(store.list("state/"), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import gzip
+import tempfile
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
+from upload_to_gcs import upload_chunks
+# The same modules upload_to_gcs.py imports (it puts src/ on sys.path)
+from object_store import MemoryStore
+from state_manager import load_state
+
+def write_packed_book(source_dir, book_id, chunks):
+    """A book_output/<book_id>/ as html_chunker.py --pack leaves it."""
+    book_dir = os.path.join(source_dir, book_id)
+    os.makedirs(book_dir, exist_ok=True)
+    pack, manifest = b"", []
+    for chunk_id, html in enumerate(chunks, 1):
+        member = gzip.compress(html.encode("utf-8"), mtime=0)
+        manifest.append({"chunk_id": chunk_id, "pack_offset": len(pack), "pack_length": len(member)})
+        pack += member
+    with open(os.path.join(book_dir, "chunks.pack"), "wb") as f:
+        f.write(pack)
+    with open(os.path.join(book_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+@mock.patch("builtins.print", lambda *args, **kwargs: None)
+class PackUploadTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_dir = tmp.name
+        self.store = MemoryStore()
+
+    def packs(self):
+        return [info.name for info in self.store.list("books/moby_dick/") if info.name.endswith(".pack")]
+
+    def read_chunk(self, chunk_id):
+        book = load_state(self.store)["moby_dick"]
+        start, end = book["chunk_offsets"][chunk_id - 1], book["chunk_offsets"][chunk_id]
+        data = self.store.get_range(f"books/moby_dick/{book['chunk_pack']}", start, end - 1)
+        return gzip.decompress(data).decode("utf-8")
+
+    def test_rebuilt_pack_gets_a_new_object(self):
+        write_packed_book(self.source_dir, "moby_dick", ["<p>Call me Ishmael.</p>", "<p>Some years ago.</p>"])
+        upload_chunks(self.store, self.source_dir)
+        first = self.packs()
+        self.assertEqual(len(first), 1)
+        self.assertRegex(first[0], r"^books/moby_dick/chunks-[0-9a-f]{16}\.pack$")
+        self.assertEqual(self.read_chunk(2), "<p>Some years ago.</p>")
+
+        # Re-chunked: the old pack stays in place (and readable) until orphans are deleted
+        write_packed_book(self.source_dir, "moby_dick", ["<p>Call me Ishmael. Some years ago.</p>"])
+        upload_chunks(self.store, self.source_dir)
+        self.assertEqual(len(self.packs()), 2)
+        self.assertIn(first[0], self.packs())
+        self.assertEqual(self.read_chunk(1), "<p>Call me Ishmael. Some years ago.</p>")
+
+        upload_chunks(self.store, self.source_dir, delete_orphans=True)
+        self.assertEqual(self.packs(), [f"books/moby_dick/{load_state(self.store)['moby_dick']['chunk_pack']}"])
+        self.assertNotIn(first[0], self.packs())
+
+if __name__ == "__main__":
+    unittest.main()